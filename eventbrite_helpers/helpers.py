@@ -1,19 +1,34 @@
 #!/usr/bin/env python3
 
 import argparse, sys, os
-import json
-import requests
-import jinja2
+import json, copy
+import sqlite3
+import struct, zlib
+import hashlib
+import abc, collections.abc
+import requests, requests.adapters
+import jinja2, markupsafe
 import pytz, datetime, dateutil.parser
 import re
 import logging, logging.handlers
 import pprint
 import yaml
 import time
+import email.utils
+import random
+import threading, functools
+import concurrent.futures, multiprocessing
+from urllib.parse import urlparse, urlencode, parse_qsl
 from bs4 import BeautifulSoup
 
 RSS_TEMPLATE="rss_template_eventbrite.jinja2"
 ICAL_TEMPLATE="ical_template_eventbrite.jinja2"
+TEMPLATES = {'rss': RSS_TEMPLATE, 'ical': ICAL_TEMPLATE}
+
+# One <item> or VEVENT. The feed templates just string these together.
+RSS_ITEM_TEMPLATE="rss_item_eventbrite.jinja2"
+ICAL_ITEM_TEMPLATE="ical_item_eventbrite.jinja2"
+ITEM_TEMPLATES = {'rss': RSS_ITEM_TEMPLATE, 'ical': ICAL_ITEM_TEMPLATE}
 
 # I can't remember which Stack Exchange post I stole this from
 # But it seems to work
@@ -26,6 +41,16 @@ LOGLEVELS = ['debug', 'info', 'warning', 'error', 'critical', 'silent']
 # Also this string appears elsewhere, so it violates DRY
 SERVER_DATA_REGEXP = re.compile(r'window.__SERVER_DATA__ = (.+});')
 
+# For pulling <script> blocks out of raw HTML without building a DOM.
+# Group 1 is the attributes and group 2 is the contents. 
+SCRIPT_BLOCK_REGEXP = re.compile(
+  r'<script\b([^>]*)>(.*?)</script\s*>',
+  re.DOTALL | re.IGNORECASE,
+  )
+SCRIPT_ATTR_REGEXP = re.compile(
+  r'''([\w:-]+)\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s"'>]+))'''
+  )
+
 # See:
 # https://stackoverflow.com/questions/730133/invalid-characters-in-xml
 INVALID_XML_CHARS=re.compile(
@@ -33,14 +58,109 @@ INVALID_XML_CHARS=re.compile(
   )
 INVALID_FILENAME_CHARS=re.compile(r'[/?]')
 
+# For CompactEventStore. The eager keys are decoded at load time,
+# and must include everything prepare_event_lists looks at.
+COMPACT_MAGIC = b'EBC1'
+COMPACT_FOOTER = struct.Struct('>QI4s')
+COMPACT_EAGER_KEYS = ('id', 'end', 'published', 'changed', 'extrainfo')
+
+# The parts of a scraped event that go into event_fingerprint(). 
+# ld+json events use the camelCase ones and __NEXT_DATA__ events use
+# the others.
+FINGERPRINT_KEYS = [
+  'name', 'startDate', 'endDate', 'description', 'location', 'offers',
+  'start_date', 'start_time', 'end_date', 'end_time', 'summary', 
+  'primary_venue', 'ticket_availability', 'is_free',
+  ]
+
+# The parts of ticket_availability that are the same for every 
+# instance of a series (see derive_series_event)
+SERIES_SHARED_TICKET_KEYS = ['minimum_ticket_price', 'maximum_ticket_price']
+
+# How many hours to remember that an event was not worth fetching,
+# by reason. Override with eventbrite.negative_cache_ttls. Failed 
+# API calls back off: each failure in a row doubles the time, up to 
+# eventbrite.negative_cache_max_hours.
+NEGATIVE_CACHE_TTLS = {
+  'past': 24 * 7,
+  'too_far': 24,
+  'not_found': 24,    # 404 or 410
+  'forbidden': 24,    # 401 or 403
+  'api_error': 1,     # anything else
+  }
+
+# The shape of the dates Eventbrite gives us (2017-04-01T10:00:00, 
+# 2017-04-01T14:00:00Z, 2017-04-01T10:00:00-04:00 and so on). These
+# go to datetime.fromisoformat, and anything else to dateutil.
+ISO_DATETIME_REGEXP = re.compile(
+  r'^\d{4}-\d{2}-\d{2}'
+  r'(T\d{2}:\d{2}(:\d{2}(\.\d{3}|\.\d{6})?)?)?'
+  r'(Z|[+-]\d{2}:\d{2})?$'
+  )
+
+# Hang on to this: the tests swap datetime.datetime out from under us.
+_fromisoformat = datetime.datetime.fromisoformat
+
 # 406: not acceptable (you is blocked)
 # 429: past rate limit (ugh)
 EVENTBRITE_LIMIT_STATUSES = [406, 429,]
 
-_num_api_calls = 0
+# The most requests the /batch/ endpoint takes in one call
+EVENTBRITE_BATCH_LIMIT = 20
 
-# This is a bad default but whatevs. Fix in config.
-_current_backoff = 1
+# Statuses in a /batch/ response that will not get better by asking
+# again. Anything else that failed is left for the next run.
+BATCH_FINAL_STATUSES = [401, 403, 404, 410]
+
+_num_api_calls = 0
+_num_api_calls_lock = threading.Lock()
+
+# time.time() of every API request this run, for the budget planner.
+# Protected by _num_api_calls_lock.
+_api_call_times = []
+
+# TokenBuckets, indexed by (kind, host). See get_rate_bucket().
+_rate_buckets = {}
+_rate_buckets_lock = threading.Lock()
+
+# One semaphore per host, so concurrent crawls do not gang up on
+# a single Eventbrite server.
+_host_semaphores = {}
+_host_semaphores_lock = threading.Lock()
+
+# HTTP status of API calls that failed this run, indexed by event ID
+# (None if there was no response). incorporate_events uses these for
+# the negative cache.
+_api_failures = {}
+_api_failures_lock = threading.Lock()
+
+# IDs of events the API did not get to this run (eg a /batch/ that 
+# failed), which should be tried again next run instead of being 
+# treated as failures. Protected by _api_failures_lock.
+_api_deferred = set()
+
+# Shared keep-alive session for everything we fetch. Made on demand
+# by get_http_session().
+_http_session = None
+_http_session_lock = threading.Lock()
+
+# jinja2 Environments, indexed by (kind, bytecode cache folder). 
+# See get_template().
+_template_envs = {}
+_template_envs_lock = threading.Lock()
+
+# Feeds for render_job() to render. Set by render_feeds() just before
+# it forks, so worker processes inherit the event lists instead of 
+# having them pickled over.
+_render_jobs = []
+
+# The FragmentCache for this run, if paths.fragment_cache is set. 
+# Made by open_fragment_cache().
+_fragment_cache = None
+
+# The DescriptionStore for this run, if paths.description_store is
+# set. Made by open_description_store().
+_description_store = None
 
 # ---- EXCEPTIONS -----
 class NoEventbriteIDException(Exception):
@@ -172,6 +292,47 @@ def event_in_boundary(config, event):
         return False
 
 
+# ------------------------------
+@functools.lru_cache(maxsize=65536)
+def parse_date_string(date_string):
+    """ Parse date_string into a datetime. The same few strings 
+        (start, end, changed...) get parsed over and over by the 
+        filters, so remember the answers. Well-formed ISO dates are
+        parsed with datetime.fromisoformat, which is much faster than
+        dateutil. dateutil gets everything else.
+    """
+
+    if ISO_DATETIME_REGEXP.match(date_string):
+        if date_string.endswith("Z"):
+            date_string = date_string[:-1] + "+00:00"
+        try:
+            return _fromisoformat(date_string)
+        except ValueError:
+            pass
+
+    return dateutil.parser.parse(date_string)
+
+# ------------------------------
+def parse_datetime(date):
+    """ Produce a datetime from date, which is either a datetime 
+        already (which is left alone) or a string (see 
+        parse_date_string).
+    """
+
+    if isinstance(date, str):
+        return parse_date_string(date)
+
+    if isinstance(date, datetime.date):
+        return date
+
+    return dateutil.parser.parse(date)
+
+# ------------------------------
+@functools.lru_cache(maxsize=None)
+def get_timezone(name):
+    """ pytz.timezone(name), looked up once. """
+    return pytz.timezone(name)
+
 # ------------------------------
 def get_rfc822_datestring (google_date): 
     """ Convert whatever date Google is using to the RFC-822 dates
@@ -180,7 +341,7 @@ def get_rfc822_datestring (google_date):
 
     # Sometimes dates look like "0000-12-29T00:00.000Z" and this
     # confuses the date parser...
-    d = dateutil.parser.parse(google_date)
+    d = parse_datetime(google_date)
 
     # Output the proper format
     return d.strftime("%a, %d %b %Y %T %z")
@@ -192,7 +353,7 @@ def get_ical_datetime (local_date):
         20190303T042300 . This is LOCAL DATE.
     """
 
-    d = dateutil.parser.parse(local_date)
+    d = parse_datetime(local_date)
 
     return d.strftime("%Y%m%dT%H%M00")
 
@@ -204,8 +365,8 @@ def get_ical_datetime_utc (local_date):
         20190303T042300 . This is UTC date.
     """
 
-    d = dateutil.parser.parse(local_date)
-    d_utc = d.astimezone(pytz.timezone('UTC'))
+    d = parse_datetime(local_date)
+    d_utc = d.astimezone(pytz.utc)
 
     return d_utc.strftime("%Y%m%dT%H%M00Z")
 
@@ -216,7 +377,7 @@ def datetime_to_utc_string (d):
         a string representing the datetime as UTC.
     """
 
-    d_utc = d.astimezone(pytz.timezone('UTC'))
+    d_utc = d.astimezone(pytz.utc)
     return d_utc.strftime("%FT%H:%M:%SZ")
 
 
@@ -226,7 +387,7 @@ def get_iso8601_datetime (google_date):
     """ Convert a date to something that is easy to copy 
         and paste: 2019-03-03 04:34
     """
-    d = dateutil.parser.parse(google_date)
+    d = parse_datetime(google_date)
 
     # 2005-10-02 20:00
     return d.strftime("%F %H:%M")
@@ -235,7 +396,7 @@ def get_iso8601_datetime (google_date):
 def get_human_datestring (google_date): 
     """ RFC 822 is ugly for humans. Use something nicer. """
 
-    d = dateutil.parser.parse(google_date)
+    d = parse_datetime(google_date)
     
     # Wednesday, Oct 02 2005, 8:00pm
     return d.strftime("%A, %b %d %Y, %l:%M%P")
@@ -245,7 +406,7 @@ def get_human_dateonly (google_date):
     """ If there is no minute defined then the date looks bad.
     """
 
-    d = dateutil.parser.parse(google_date)
+    d = parse_datetime(google_date)
     
     # Wednesday, Oct 02 2005
     return d.strftime("%A, %b %d %Y")
@@ -254,7 +415,7 @@ def get_human_dateonly (google_date):
 def get_short_human_dateonly (google_date):
     """ Readable by humans, but shorter. """
 
-    d = dateutil.parser.parse(google_date)
+    d = parse_datetime(google_date)
 
     # Sun, Feb 18
     return d.strftime("%a, %b %e")
@@ -263,7 +424,7 @@ def get_short_human_dateonly (google_date):
 def get_short_human_datetime (google_date):
     """ Date time readable by humans, but shorter. """
 
-    d = dateutil.parser.parse(google_date)
+    d = parse_datetime(google_date)
 
     # Sun, Feb 18, 8:00pm
     return d.strftime("%a, %b %e, %l:%M%P")
@@ -273,7 +434,7 @@ def get_short_human_datetime (google_date):
 def get_human_timeonly (google_date):
     """ Forget the date. Just gimme the time"""
 
-    d = dateutil.parser.parse(google_date)
+    d = parse_datetime(google_date)
     #  8:00pm
     return d.strftime("%l:%M%P")
 
@@ -283,8 +444,8 @@ def get_duration_in_minutes(end_date, start_date):
         Call this on the end.
     """
 
-    d_end = dateutil.parser.parse(end_date)
-    d_start = dateutil.parser.parse(start_date)
+    d_end = parse_datetime(end_date)
+    d_start = parse_datetime(start_date)
 
     diff = d_end - d_start
     one_minute = datetime.timedelta(minutes=1)
@@ -299,7 +460,7 @@ def get_time_now(config):
         "America/Toronto"
     """
    
-    target_timezone = pytz.timezone(config['feeds']['timezone'])
+    target_timezone = get_timezone(config['feeds']['timezone'])
     time_now = datetime.datetime.now(tz=target_timezone)
 
     return time_now
@@ -380,6 +541,370 @@ def get_ical_block(text, prefix=""):
 
     return retval
 
+# ------------------------------
+def strip_token(url):
+    """ Remove the API token from the query string of url, so it does 
+        not end up in filenames. 
+    """
+
+    parts = urlparse(url)
+    query = [(key, value) for key, value in parse_qsl(parts.query)
+      if key != 'token']
+
+    return parts._replace(query=urlencode(query)).geturl()
+
+# ------------------------------
+def capture_filename(url, body=None):
+    """ Where --dump-dir keeps the response for a request, and where 
+        --replay-dir looks for it. Produces (subfolder, filename, 
+        extension).
+
+        Listing pages go in html-pages (as they always have). API 
+        responses go in api-responses, without the token. Requests 
+        with a body (like /batch/) get a hash of the body tacked on,
+        since the URL is the same every time.
+    """
+
+    url = strip_token(url)
+
+    if not urlparse(url).netloc.endswith("eventbriteapi.com"):
+        return "html-pages", url_to_filename(url), "html"
+
+    filename = url_to_filename(url)
+    if body:
+        if isinstance(body, str):
+            body = body.encode('utf8')
+        filename = "{}-{}".format(filename, 
+          hashlib.sha1(body).hexdigest()[:12])
+
+    return "api-responses", filename, "json"
+
+# ------------------------------
+def record_api_response(config, response):
+    """ Save an API response in the dump folder so --replay-dir can 
+        serve it later.
+
+        Pre: config['flags']['dump'] is true
+    """
+
+    # After a redirect, response.request is the last hop. Replays see
+    # the request we made, so file it under that.
+    request = response.request
+    if getattr(response, 'history', None):
+        request = response.history[0].request
+
+    subdir, filename, file_ext = capture_filename(
+      request.url, 
+      request.body,
+      )
+    dump_file(response.json(), ensure_dumpdir(config, subdir), filename, 
+      file_ext)
+
+# ------------------------------
+class ReplayAdapter(requests.adapters.BaseAdapter):
+    """ A requests transport that answers from a folder made with 
+        --dump-dir instead of the network (see capture_filename). 
+        Anything that was not captured gets a 404.
+    """
+
+    def __init__(self, replay_dir):
+        super().__init__()
+        self.replay_dir = replay_dir
+
+    def send(self, request, **kwargs):
+        subdir, filename, file_ext = capture_filename(
+          request.url, 
+          request.body,
+          )
+        capture = os.path.join(self.replay_dir, subdir, 
+          "{}.{}".format(filename, file_ext))
+
+        response = requests.Response()
+        response.request = request
+        response.url = request.url
+        response.encoding = 'utf8'
+
+        if os.path.isfile(capture):
+            with open(capture, "rb") as infile:
+                response._content = infile.read()
+            response.status_code = 200
+            response.reason = "OK"
+        else:
+            logging.warning("Replay: nothing captured for {}".format(
+              strip_token(request.url)))
+            response._content = b""
+            response.status_code = 404
+            response.reason = "Not Captured"
+
+        return response
+
+    def close(self):
+        pass
+
+# ------------------------------
+def get_http_session(config):
+    """ Produce the shared requests Session, making it the first time 
+        through. Connections to www.eventbrite.* and 
+        www.eventbriteapi.com are kept alive and reused, so we only pay
+        for the TCP+TLS handshake once per pooled connection.
+
+        Pool sizes come from the 'http' section of the config. 
+        pool_maxsize should be at least as big as the number of threads
+        that fetch at once, or urllib3 will throw connections away.
+
+        With --replay-dir, the session answers from the captured 
+        files instead (see ReplayAdapter).
+    """
+
+    global _http_session
+
+    with _http_session_lock:
+        if _http_session is None:
+            http_conf = config.get('http') or {}
+
+            if (config.get('flags') or {}).get('replay'):
+                adapter = ReplayAdapter(config['paths']['replay_path'])
+            else:
+                adapter = requests.adapters.HTTPAdapter(
+                  pool_connections=http_conf.get('pool_connections', 4),
+                  pool_maxsize=http_conf.get('pool_maxsize', 10),
+                  )
+
+            session = requests.Session()
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+
+            _http_session = session
+
+        return _http_session
+
+# ------------------------------
+def http_request(config, method, url, **kwargs):
+    """ Make an HTTP request through the shared session. Takes the same
+        keyword arguments as requests.request, and produces a 
+        Response. 
+
+        If no timeout is given, use the connect_timeout and 
+        read_timeout (in seconds) from the config.
+    """
+
+    http_conf = config.get('http') or {}
+
+    if 'timeout' not in kwargs:
+        kwargs['timeout'] = (
+          http_conf.get('connect_timeout', 10),
+          http_conf.get('read_timeout', 60),
+          )
+
+    return get_http_session(config).request(method, url, **kwargs)
+
+# ------------------------------
+class TokenBucket:
+    """ A token bucket for pacing requests to one host. Tokens drip in
+        at rate per second, up to capacity (the burst size), and each
+        request takes one. A rate of None means no pacing at all 
+        (except for pause()).
+
+        The bucket also remembers the current backoff (in minutes) for 
+        its host. It is shared by every thread using the bucket, so 
+        it only changes under the lock (see note_limited() and 
+        note_success()). pause() empties the bucket so every thread 
+        using it waits out a 429 together.
+    """
+
+    def __init__(self, rate, capacity, backoff):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.initial_backoff = backoff
+        self.backoff = backoff
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """ Block until a token is available, then take it. """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if self.rate is not None:
+                    self.tokens = min(
+                      self.capacity,
+                      self.tokens + (now - self.updated) * self.rate,
+                      )
+                self.updated = now
+
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                elif self.rate is None:
+                    return
+                elif self.tokens >= 1:
+                    self.tokens = self.tokens - 1
+                    return
+                else:
+                    wait = (1 - self.tokens) / self.rate
+
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """ Hand out no tokens for the next seconds seconds. """
+        with self.lock:
+            self.paused_until = max(
+              self.paused_until, 
+              time.monotonic() + seconds,
+              )
+            self.tokens = 0
+
+    def note_limited(self):
+        """ A request got a 429. Produce the backoff (in minutes) to 
+            use for it, and double the backoff for the next one.
+        """
+        with self.lock:
+            backoff = self.backoff
+            self.backoff = self.backoff * 2
+            return backoff
+
+    def note_success(self):
+        """ A request got through. Ease the backoff back down. Other
+            threads may still be getting 429s, so only halve it 
+            instead of starting over.
+        """
+        with self.lock:
+            self.backoff = max(self.initial_backoff, self.backoff / 2)
+
+
+# ------------------------------
+def get_rate_bucket(config, kind, url):
+    """ Produce the TokenBucket for requests of this kind ('scrape' or 
+        'api') to the host of url, making it the first time through.
+        Rates come from eventbrite.rate_limits in the config. Kinds 
+        that are not listed there are not paced (which is how things
+        worked before rate_limits existed).
+    """
+
+    host = urlparse(url).netloc
+    key = (kind, host)
+
+    with _rate_buckets_lock:
+        if key not in _rate_buckets:
+            limits = (config['eventbrite'].get('rate_limits') or {}).get(
+              kind)
+
+            if limits is None:
+                rate, capacity = None, 1
+            else:
+                rate = limits.get('per_second', 1)
+                capacity = limits.get('burst', 1)
+
+            _rate_buckets[key] = TokenBucket(
+              rate,
+              capacity,
+              config['eventbrite'].get('backoff_initial', 1),
+              )
+
+        return _rate_buckets[key]
+
+
+# ------------------------------
+def retry_after_seconds(response):
+    """ Produce the number of seconds a Retry-After header asks us to
+        wait, or None if there is no (sensible) header. It may be 
+        seconds or an HTTP date.
+    """
+
+    retry_after = response.headers.get('Retry-After')
+    if not retry_after:
+        return None
+
+    try:
+        return max(0, int(retry_after))
+    except ValueError:
+        pass
+
+    try:
+        retry_date = email.utils.parsedate_to_datetime(retry_after)
+    except (TypeError, ValueError):
+        return None
+
+    if retry_date is None:
+        return None
+
+    if retry_date.tzinfo is None:
+        retry_date = retry_date.replace(tzinfo=datetime.timezone.utc)
+
+    delta = retry_date - datetime.datetime.now(tz=datetime.timezone.utc)
+    return max(0, delta.total_seconds())
+
+
+# ------------------------------
+def rate_limited_request(config, kind, method, url, **kwargs):
+    """ Make an HTTP request like http_request, but wait for a token 
+        from the rate bucket for this kind ('scrape' or 'api') and host
+        first. Scraping also respects max_requests_per_host.
+
+        A 429 is retried after the Retry-After the server asked for,
+        or else after a jittered exponential backoff starting at 
+        backoff_initial minutes. Once the backoff goes over 
+        backoff_limit we give up and return the 429 response, so the 
+        caller can raise_for_status() as usual.
+    """
+
+    bucket = get_rate_bucket(config, kind, url)
+    backoff_limit = config['eventbrite'].get('backoff_limit', 0)
+
+    while True:
+        # Replays do not touch the network, so there is no need to 
+        # be polite
+        if not (config.get('flags') or {}).get('replay'):
+            bucket.acquire()
+
+        if kind == 'scrape':
+            with host_semaphore(config, url):
+                r = http_request(config, method, url, **kwargs)
+        else:
+            r = http_request(config, method, url, **kwargs)
+
+        if r.status_code != 429:
+            bucket.note_success()
+            return r
+
+        backoff = bucket.note_limited()
+
+        if backoff > backoff_limit:
+            logging.warning("Received {} from {}. Backoff value {} is over "
+              "limit {}. Giving up.".format(
+                r.status_code,
+                r.url,
+                backoff,
+                backoff_limit,
+                ))
+            return r
+
+        wait = retry_after_seconds(r)
+
+        if wait is None:
+            # Somewhere between half and all of the backoff, so 
+            # threads that got 429s together do not retry together.
+            wait = 60 * backoff * random.uniform(0.5, 1.0)
+        elif wait > 60 * backoff_limit:
+            logging.warning("Received {} from {}, and were asked to wait "
+              "{} seconds. Giving up.".format(
+                r.status_code,
+                r.url,
+                wait,
+                ))
+            return r
+
+        logging.info("Received {} from {}. Sleeping for {:.0f} "
+          "seconds. Zzzz".format(
+            r.status_code,
+            r.url,
+            wait,
+            ))
+
+        bucket.pause(wait)
+
+
 # ------------------------------
 """ This calls the Eventbrite search API. May return an error 
     that we ought to handle, but don't.
@@ -422,7 +947,8 @@ def call_events_api(config):
 
         api_params.update(query_args)
 
-        r = requests.get(search_api_url, api_params)
+        r = rate_limited_request(config, 'api', 'GET', search_api_url, 
+          params=api_params)
 
         if r.status_code in EVENTBRITE_LIMIT_STATUSES:
             more_items = False
@@ -499,7 +1025,10 @@ def call_events_api(config):
               'batch': json.dumps(desc_params)
               }
 
-            rd = requests.post(
+            rd = rate_limited_request(
+              config,
+              'api',
+              'POST',
               "{}/batch/".format(BASE_URL,),
               params=desc_api_params,
               data=batch_params,
@@ -526,14 +1055,17 @@ def call_events_api(config):
     return event_list
 
 # -----------------------------
-def call_api(api_url, api_params):
+def call_api(config, api_url, api_params):
     """ Call the Eventbrite API and produce the JSON, or an exception.
     """
     global _num_api_calls
 
-    r = requests.get(api_url, api_params)
+    r = rate_limited_request(config, 'api', 'GET', api_url, 
+      params=api_params)
 
-    _num_api_calls = _num_api_calls + 1
+    with _num_api_calls_lock:
+        _num_api_calls = _num_api_calls + 1
+        _api_call_times.append(time.time())
 
     if r.status_code in EVENTBRITE_LIMIT_STATUSES:
         logging.warn("Received status code {} "
@@ -544,18 +1076,64 @@ def call_api(api_url, api_params):
 
     r.raise_for_status()
 
+    if config['flags'].get('dump'):
+        record_api_response(config, r)
 
     return r.json() 
 
 
+# ------------------------------
+def note_api_failure(id, error):
+    """ Remember the status code of a failed API call for event id. """
+
+    status = None
+    if getattr(error, 'response', None) is not None:
+        status = error.response.status_code
+
+    note_api_status(id, status)
 
 # ------------------------------
-def get_event_from_api(config, id):
-    """ This calls the Eventbrite event API. May return an error 
-        that we ought to handle, but don't.
+def note_api_status(id, status):
+    """ Remember that the API call for event id failed with status. """
 
-        config: The configuration dict
-        id: The ID of the event to get
+    with _api_failures_lock:
+        _api_failures[id] = status
+
+# ------------------------------
+def note_api_deferred(id):
+    """ Remember that event id should be fetched next run instead. """
+
+    with _api_failures_lock:
+        _api_deferred.add(id)
+
+# ------------------------------
+def pop_api_deferred():
+    """ Produce the IDs noted by note_api_deferred, and forget them. """
+
+    global _api_deferred
+
+    with _api_failures_lock:
+        deferred = _api_deferred
+        _api_deferred = set()
+
+    return deferred
+
+# ------------------------------
+def pop_api_failures():
+    """ Produce the API failures noted so far, and forget them. """
+
+    global _api_failures
+
+    with _api_failures_lock:
+        failures = _api_failures
+        _api_failures = {}
+
+    return failures
+
+# ------------------------------
+def event_api_request(config, id):
+    """ Produce the (url, params) to fetch event id from the API, with
+        the venue, organizer and tickets expanded.
     """
 
     BASE_URL = "https://www.eventbriteapi.com/v3"
@@ -565,142 +1143,648 @@ def get_event_from_api(config, id):
       id,
       )
 
-    desc_api_url = "{}/events/{}/description".format(
-      BASE_URL,
-      id,
-      )
-
     event_api_params = { 
       'token': config['eventbrite']['api_token'],
       'expand' : \
         'venue,organizer,ticket_availability',
       }
 
+    return event_api_url, event_api_params
+
+# ------------------------------
+def description_api_request(config, id):
+    """ Produce the (url, params) to fetch the full description of 
+        event id from the API.
+    """
+
+    BASE_URL = "https://www.eventbriteapi.com/v3"
+
+    desc_api_url = "{}/events/{}/description".format(
+      BASE_URL,
+      id,
+      )
+
     desc_api_params = { 
       'token': config['eventbrite']['api_token'],
        }
 
+    return desc_api_url, desc_api_params
+
+# ------------------------------
+def get_event_from_api(config, id):
+    """ This calls the Eventbrite event API. May return an error 
+        that we ought to handle, but don't.
+
+        config: The configuration dict
+        id: The ID of the event to get
+    """
+
+    event_api_url, event_api_params = event_api_request(config, id)
+    desc_api_url, desc_api_params = description_api_request(config, id)
 
     try:
-        event = call_api(event_api_url, event_api_params)
+        event = call_api(config, event_api_url, event_api_params)
 
         # TODO: Get rid of this option?
         if config['eventbrite']['get_full_descriptions']:
-            desc = call_api(desc_api_url, desc_api_params)
+            desc = call_api(config, desc_api_url, desc_api_params)
             event['full_description'] = desc['description']
     
-    except requests.exceptions.HTTPError as e:
-        # Failed. Now what?
+    except requests.exceptions.RequestException as e:
+        # Failed (or timed out). Now what?
         # The description may or may not be present. Ugh.
         logging.error("get_event_from_api: Received API error: {}".format(e))
+        note_api_failure(id, e)
         return None
 
     return event
 
 
-# -----------------------------
-def print_json(j):
-    """ Print JSON nicely, because debugging is frustrating.
+# ------------------------------
+def get_events_from_api(config, ids):
+    """ Fetch a bunch of events from the API. Produces a dict from 
+        event ID to the API event, or None if fetching that event 
+        failed (just like get_event_from_api).
+
+        With api_workers bigger than 1, the event and description 
+        calls for all the IDs are fanned out to a pool of threads. 
+        The API rate bucket keeps the pool under its rate limit.
+
+        If api_batch_size is set then use the /batch/ endpoint
+        instead (see get_events_from_batch_api).
     """
-    print(json.dumps(j, indent=2, separators=(',', ': ')))
 
+    if config['eventbrite'].get('api_batch_size'):
+        return get_events_from_batch_api(config, ids)
 
+    num_workers = config['eventbrite'].get('api_workers', 1)
 
-# ------------------------------
-def generate_ical(conf, cal_dict, feed_key):
-    """ Generate an iCal feed given a JSON file. The feed_key should
-        be a feed defined in the config file. eg 'base_feed'
-    """
+    if num_workers <= 1 or len(ids) <= 1:
+        return {id: get_event_from_api(config, id) for id in ids}
 
-    # --- Process template 
+    logging.info("Fetching {} events with {} API workers".format(
+      len(ids),
+      num_workers,
+      ))
 
-    template_loader = jinja2.FileSystemLoader(
-        searchpath=TEMPLATE_FOLDER
-        )
-    template_env = jinja2.Environment( 
-        loader=template_loader,
-        autoescape=False,
-        )
-    template_env.filters['print'] = print_from_template
-    template_env.filters['cleanurl'] = clean_eventbrite_url
-    template_env.filters['ical_block'] = get_ical_block
-    template_env.filters['ical_datetime'] = get_ical_datetime
-    template_env.filters['ical_datetime_utc'] = get_ical_datetime_utc
-    template_env.filters['ical_escape'] = ical_escape
+    api_events = {}
 
-    time_now = get_time_now(conf)
-    time_now_formatted = time_now.strftime("%a, %d %b %Y %T %z")
+    with concurrent.futures.ThreadPoolExecutor(
+      max_workers=num_workers) as executor:
 
-    # Remove http:// or https:// from the website.
-    # This produces a LIST, and we take the final part.
-    bare_website = conf['feeds']['website'].split("//")[-1]
+        event_futures = {}
+        desc_futures = {}
 
-    feed_info = conf['feeds'][feed_key]
+        for id in ids:
+            event_api_url, event_api_params = event_api_request(config, id)
+            event_futures[id] = executor.submit(
+              call_api, config, event_api_url, event_api_params)
 
-    selflink = "{}/{}.ics".format(
-      conf['feeds']['website'],
-      feed_info['name'],
-      )
+            if config['eventbrite']['get_full_descriptions']:
+                desc_api_url, desc_api_params = \
+                  description_api_request(config, id)
+                desc_futures[id] = executor.submit(
+                  call_api, config, desc_api_url, desc_api_params)
 
-    template = template_env.get_template( ICAL_TEMPLATE ) 
-    template_vars = { 
-      "feed_title": feed_info['title'],
-      "feed_description": feed_info['description'],
-      "feed_webmaster" : conf['feeds']['webmaster'],
-      "feed_webmaster_name" : conf['feeds']['webmaster_name'],
-      "feed_builddate" : time_now_formatted,
-      "feed_pubdate" : time_now_formatted,
-      "feed_website" : bare_website,
-      "feed_items" : cal_dict,
-      "feed_selflink" : selflink,
-      "feed_currency" : conf['feeds']['currency_symbol'],
-      "feed_full_descriptions" : conf['eventbrite']['get_full_descriptions'],
-      "feed_timezone" : conf['feeds']['timezone'],
-      }
+        for id in ids:
+            try:
+                event = event_futures[id].result()
+
+                if id in desc_futures:
+                    desc = desc_futures[id].result()
+                    event['full_description'] = desc['description']
 
-    output_ical = template.render(template_vars)
+            except requests.exceptions.RequestException as e:
+                logging.error("get_events_from_api: Received API "
+                  "error: {}".format(e))
+                note_api_failure(id, e)
+                event = None
 
-    return output_ical
+            api_events[id] = event
+
+    return api_events
 
 
 # ------------------------------
-def generate_rss(conf, cal_dict, feed_key):
-    """ Given a JSON formatted calendar dictionary, make and return 
-        the RSS file. feed_key should be defined as a feed in the
-        YAML.
+def call_batch_api(config, batch_requests):
+    """ POST a list of requests (dicts with 'method' and 
+        'relative_url') to the /batch/ endpoint. Produces the list of
+        responses, each a dict with 'code', 'headers' and 'body' (a 
+        JSON string), or raises an exception.
     """
+    global _num_api_calls
 
-    # --- Process template 
+    BASE_URL = "https://www.eventbriteapi.com/v3"
 
-    template_loader = jinja2.FileSystemLoader(
-        searchpath=TEMPLATE_FOLDER
-        )
-    template_env = jinja2.Environment( 
-        loader=template_loader,
-        autoescape=True,
-        )
-    template_env.filters['rfc822'] = get_rfc822_datestring
-    template_env.filters['humandate'] = get_human_datestring
-    template_env.filters['humandateonly'] = get_human_dateonly
-    template_env.filters['iso8601'] = get_iso8601_datetime 
-    template_env.filters['print'] = print_from_template
-    template_env.filters['cleanurl'] = clean_eventbrite_url
-    template_env.filters['cleanxml'] = remove_invalid_xml_chars
-    template_env.filters['minutes_since'] = get_duration_in_minutes
+    r = rate_limited_request(
+      config,
+      'api',
+      'POST',
+      "{}/batch/".format(BASE_URL,),
+      params={'token': config['eventbrite']['api_token']},
+      data={'batch': json.dumps(batch_requests)},
+      )
 
+    with _num_api_calls_lock:
+        _num_api_calls = _num_api_calls + 1
+        # As far as I can tell every request in the batch counts
+        # against the hourly limit, so be pessimistic.
+        _api_call_times.extend([time.time()] * len(batch_requests))
 
-    time_now = get_time_now(conf)
-    time_now_formatted = time_now.strftime("%a, %d %b %Y %T %z")
+    if r.status_code in EVENTBRITE_LIMIT_STATUSES:
+        logging.warn("Received status code {} "
+          "after {} API calls this run".format(
+          r.status_code,
+          _num_api_calls
+          ))
 
-    # Copy and paste. What could go wrong?
-    feed_info = conf['feeds'][feed_key]
+    r.raise_for_status()
 
-    selflink = "{}/{}.rss".format(
-      conf['feeds']['website'],
-      feed_info['name'],
-      )
+    if config['flags'].get('dump'):
+        record_api_response(config, r)
+
+    return r.json()
+
+
+# ------------------------------
+def batch_response_json(response):
+    """ Produce the decoded body of one /batch/ response, or None if 
+        that request did not succeed.
+    """
+
+    if not isinstance(response, dict) or response.get('code') != 200:
+        return None
+
+    try:
+        return json.loads(response['body'])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+# ------------------------------
+def batch_response_url(response):
+    """ Produce the relative_url a /batch/ response says it is for 
+        (without the query string or slashes at the ends), or None if
+        it does not say.
+    """
+
+    if not isinstance(response, dict):
+        return None
+
+    relative_url = response.get('relative_url')
+    if relative_url is None and isinstance(response.get('request'), dict):
+        relative_url = response['request'].get('relative_url')
+
+    if not isinstance(relative_url, str):
+        return None
+
+    return relative_url.split("?")[0].strip("/")
+
+# ------------------------------
+def get_event_batch(config, ids):
+    """ Fetch the events in ids (and their descriptions) with a single
+        /batch/ call. Produces a dict from ID to event or None, like 
+        get_events_from_api.
+
+        Responses are matched to what we asked for by their 
+        relative_url. If a response does not say, event bodies are 
+        matched by their 'id', and descriptions (which have no ID) by
+        their place in the list, as long as the list is the length 
+        we expected.
+
+        Nothing is fetched again on its own here, since the budget
+        planner did not count on those calls. Events that came back 
+        with a BATCH_FINAL_STATUSES error are failures (see 
+        note_api_status). Anything else that is missing is left for 
+        the next run (see note_api_deferred).
+    """
+
+    get_descriptions = config['eventbrite']['get_full_descriptions']
+
+    batch_requests = []
+    # What each request is for: (id, 'event' or 'description')
+    batch_keys = []
+    for id in ids:
+        batch_requests.append({
+          'method': 'GET',
+          'relative_url': 
+            "events/{}/?expand=venue,organizer,ticket_availability".format(
+              id,
+              ),
+          })
+        batch_keys.append((id, 'event'))
+        if get_descriptions:
+            batch_requests.append({
+              'method': 'GET',
+              'relative_url': "events/{}/description/".format(id),
+              })
+            batch_keys.append((id, 'description'))
+
+    try:
+        responses = call_batch_api(config, batch_requests)
+    except requests.exceptions.RequestException as e:
+        logging.error("get_event_batch: Received API error: {}. "
+          "Leaving {} events for next run.".format(e, len(ids)))
+        responses = []
+
+    if not isinstance(responses, list):
+        responses = []
+
+    keys_by_url = {batch_response_url(request): key 
+      for request, key in zip(batch_requests, batch_keys)}
+    in_order = len(responses) == len(batch_requests)
+
+    bodies = {}
+    statuses = {}
+
+    for pos, response in enumerate(responses):
+        url = batch_response_url(response)
+        body = batch_response_json(response)
+
+        if url is not None:
+            key = keys_by_url.get(url)
+        elif isinstance(body, dict) and 'id' in body:
+            key = (str(body['id']), 'event')
+        elif in_order:
+            key = batch_keys[pos]
+        else:
+            key = None
+
+        if key is None:
+            continue
+
+        if body is not None:
+            bodies[key] = body
+        elif isinstance(response, dict):
+            statuses[key] = response.get('code')
+
+    api_events = {}
+
+    for id in ids:
+        event = bodies.get((id, 'event'))
+        desc = bodies.get((id, 'description'))
+
+        if event is not None and 'id' in event and \
+          (not get_descriptions or 
+            (desc is not None and 'description' in desc)):
+            if get_descriptions:
+                event['full_description'] = desc['description']
+            api_events[id] = event
+            continue
+
+        api_events[id] = None
+
+        final = [statuses[key] for key in [(id, 'event'), (id, 'description')]
+          if statuses.get(key) in BATCH_FINAL_STATUSES]
+
+        if final:
+            logging.info("{}: got {} in batch response".format(id, final[0]))
+            note_api_status(id, final[0])
+        else:
+            logging.info("{}: not in batch response. Leaving it for "
+              "next run.".format(id))
+            note_api_deferred(id)
+
+    return api_events
+
+
+# ------------------------------
+def get_events_from_batch_api(config, ids):
+    """ Fetch events through /batch/, api_batch_size events per call. 
+        Batches are spread over api_workers threads. Produces a dict 
+        from ID to event or None, like get_events_from_api.
+
+        Each event takes 2 requests if we get full descriptions, so
+        api_batch_size is cut down to fit in EVENTBRITE_BATCH_LIMIT.
+    """
+
+    batch_size = config['eventbrite']['api_batch_size']
+
+    per_event = 2 if config['eventbrite']['get_full_descriptions'] else 1
+    max_batch_size = EVENTBRITE_BATCH_LIMIT // per_event
+    if batch_size > max_batch_size:
+        logging.warning("api_batch_size {} is too big for the /batch/ "
+          "endpoint. Using {}.".format(
+            batch_size,
+            max_batch_size,
+            ))
+        batch_size = max_batch_size
+
+    num_workers = config['eventbrite'].get('api_workers', 1)
+
+    batches = [ids[pos:pos + batch_size] 
+      for pos in range(0, len(ids), batch_size)]
+
+    logging.info("Fetching {} events in {} batches".format(
+      len(ids),
+      len(batches),
+      ))
+
+    api_events = {}
+
+    if num_workers > 1 and len(batches) > 1:
+        with concurrent.futures.ThreadPoolExecutor(
+          max_workers=num_workers) as executor:
+            for batch_events in executor.map(
+              lambda batch: get_event_batch(config, batch),
+              batches):
+                api_events.update(batch_events)
+    else:
+        for batch in batches:
+            api_events.update(get_event_batch(config, batch))
+
+    return api_events
+
+
+# -----------------------------
+def print_json(j):
+    """ Print JSON nicely, because debugging is frustrating.
+    """
+    print(json.dumps(j, indent=2, separators=(',', ': ')))
+
+
+
+# ------------------------------
+def rss_full_description(item):
+    """ Template filter: the full description of item, ready for RSS. """
+    return get_full_description(item, rss_description)
+
+# ------------------------------
+def ical_full_description(item):
+    """ Template filter: the full description of item, ready for iCal. """
+    return get_full_description(item, get_ical_block)
+
+# ------------------------------
+def make_template_env(kind, bytecode_cache=None):
+    """ Build the jinja2 Environment for kind ('rss' or 'ical'), with
+        its filters.
+    """
+
+    template_loader = jinja2.FileSystemLoader(
+        searchpath=TEMPLATE_FOLDER
+        )
+    template_env = jinja2.Environment( 
+        loader=template_loader,
+        autoescape=(kind == 'rss'),
+        bytecode_cache=bytecode_cache,
+        )
+    template_env.filters['print'] = print_from_template
+    template_env.filters['cleanurl'] = clean_eventbrite_url
+
+    if kind == 'rss':
+        template_env.filters['rfc822'] = get_rfc822_datestring
+        template_env.filters['humandate'] = get_human_datestring
+        template_env.filters['humandateonly'] = get_human_dateonly
+        template_env.filters['iso8601'] = get_iso8601_datetime 
+        template_env.filters['cleanxml'] = remove_invalid_xml_chars
+        template_env.filters['minutes_since'] = get_duration_in_minutes
+        template_env.filters['full_description'] = rss_full_description
+    else:
+        template_env.filters['ical_block'] = get_ical_block
+        template_env.filters['ical_datetime'] = get_ical_datetime
+        template_env.filters['ical_datetime_utc'] = get_ical_datetime_utc
+        template_env.filters['ical_escape'] = ical_escape
+        template_env.filters['full_description'] = ical_full_description
+
+    return template_env
+
+# ------------------------------
+def get_template(config, kind, item=False):
+    """ Produce the compiled template for kind ('rss' or 'ical'), or 
+        the template for one item of it if item is true. 
+
+        The environment (and the compiled template) is made the first
+        time through and kept in _template_envs, so rendering six 
+        feeds, or running many times in one process, only compiles 
+        each template once. If paths.template_cache is set, compiled 
+        templates are also kept on disk there, so a fresh process can
+        skip compiling too.
+    """
+
+    cache_dir = None
+    if config.get('paths', {}).get('template_cache'):
+        cache_dir = get_cache_filename(config, 'template_cache')
+
+    with _template_envs_lock:
+        if (kind, cache_dir) not in _template_envs:
+            bytecode_cache = None
+            if cache_dir:
+                os.makedirs(cache_dir, exist_ok=True)
+                bytecode_cache = jinja2.FileSystemBytecodeCache(cache_dir)
+
+            template_env = make_template_env(kind, bytecode_cache)
+
+            # Compile now, while we hold the lock
+            template_env.get_template(TEMPLATES[kind])
+            template_env.get_template(ITEM_TEMPLATES[kind])
+
+            _template_envs[(kind, cache_dir)] = template_env
+
+        template_env = _template_envs[(kind, cache_dir)]
+
+    if item:
+        return template_env.get_template(ITEM_TEMPLATES[kind])
+
+    return template_env.get_template(TEMPLATES[kind])
+
+# ------------------------------
+class FragmentCache:
+    """ Rendered feed items (see render_feed_items), kept between runs
+        in one JSON file. Only the fragments used in a run are saved, 
+        so items for events that are gone drop out by themselves.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.fragments = {}
+        self.used = {}
+
+    def load(self):
+        if os.path.isfile(self.filename):
+            try:
+                with open(self.filename, "r", encoding='utf8') as infile:
+                    self.fragments = json.load(infile)
+            except ValueError as e:
+                logging.warning("Ignoring corrupt fragment cache {}: "
+                  "{}".format(self.filename, e))
+
+    def get(self, key):
+        fragment = self.fragments.get(key)
+        if fragment is not None:
+            self.used[key] = fragment
+        return fragment
+
+    def put(self, key, fragment):
+        self.fragments[key] = fragment
+        self.used[key] = fragment
+
+    def save(self):
+        tmp_file = "{}.tmp".format(self.filename)
+        with open(tmp_file, "w", encoding='utf8') as out:
+            json.dump(self.used, out)
+        os.replace(tmp_file, self.filename)
+
+# ------------------------------
+def open_fragment_cache(config):
+    """ Make and load the FragmentCache in paths.fragment_cache and 
+        make it the one for this run. If that is not set, every item
+        is rendered every time and this produces None.
+    """
+
+    global _fragment_cache
+
+    _fragment_cache = None
+
+    if config['paths'].get('fragment_cache'):
+        _fragment_cache = FragmentCache(
+          get_cache_filename(config, 'fragment_cache'))
+        _fragment_cache.load()
+
+    return _fragment_cache
+
+# ------------------------------
+def template_version(kind):
+    """ A hash of the item template for kind, so cached fragments are
+        thrown out when it is edited.
+    """
+
+    item_file = os.path.join(TEMPLATE_FOLDER, ITEM_TEMPLATES[kind])
+    with open(item_file, "rb") as infile:
+        return hashlib.sha1(infile.read()).hexdigest()[:12]
+
+# ------------------------------
+def render_feed_items(config, kind, items, item_vars):
+    """ Render each of items with the item template for kind, and 
+        item_vars (the feed settings the item template uses). 
+        Produces the strings one at a time, as the feed template 
+        asks for them.
+
+        An item is only rendered if the fragment cache does not 
+        already have it. Fragments are indexed by kind, template 
+        version, item_vars, event ID and the 'changed' time of the 
+        event, so anything that could change the output makes a new 
+        fragment.
+    """
+
+    template = get_template(config, kind, item=True)
+
+    prefix = "{}:{}:{}".format(
+      kind,
+      template_version(kind),
+      hashlib.sha1(json.dumps(item_vars, sort_keys=True).encode(
+        'utf8')).hexdigest()[:12],
+      )
+
+    num_rendered = 0
+
+    for item in items:
+        key = "{}:{}:{}".format(prefix, item['id'], item.get('changed'))
+
+        fragment = None
+        if _fragment_cache:
+            fragment = _fragment_cache.get(key)
+
+        if fragment is None:
+            fragment = template.render(item=item, **item_vars)
+            num_rendered = num_rendered + 1
+            if _fragment_cache:
+                _fragment_cache.put(key, fragment)
+
+        if kind == 'rss':
+            # Already escaped by the item template
+            fragment = markupsafe.Markup(fragment)
+
+        yield fragment
+
+    logging.debug("Rendered {} of {} {} items".format(
+      num_rendered,
+      len(items),
+      kind,
+      ))
+
+# ------------------------------
+def generate_ical(conf, cal_dict, feed_key):
+    """ Generate an iCal feed given a JSON file. The feed_key should
+        be a feed defined in the config file. eg 'base_feed'
+    """
+
+    return "".join(generate_feed_chunks(conf, 'ical', cal_dict, feed_key))
+
+
+# ------------------------------
+def ical_template_vars(conf, cal_dict, feed_key):
+    """ Produce the variables for the iCal feed template. """
+
+    time_now = get_time_now(conf)
+    time_now_formatted = time_now.strftime("%a, %d %b %Y %T %z")
+
+    # Remove http:// or https:// from the website.
+    # This produces a LIST, and we take the final part.
+    bare_website = conf['feeds']['website'].split("//")[-1]
+
+    feed_info = conf['feeds'][feed_key]
+
+    selflink = "{}/{}.ics".format(
+      conf['feeds']['website'],
+      feed_info['name'],
+      )
+
+    item_vars = {
+      "feed_website" : bare_website,
+      "feed_currency" : conf['feeds']['currency_symbol'],
+      "feed_full_descriptions" : conf['eventbrite']['get_full_descriptions'],
+      }
+
+    template_vars = { 
+      "feed_title": feed_info['title'],
+      "feed_description": feed_info['description'],
+      "feed_webmaster" : conf['feeds']['webmaster'],
+      "feed_webmaster_name" : conf['feeds']['webmaster_name'],
+      "feed_builddate" : time_now_formatted,
+      "feed_pubdate" : time_now_formatted,
+      "feed_website" : bare_website,
+      "feed_items" : cal_dict,
+      "feed_selflink" : selflink,
+      "feed_currency" : conf['feeds']['currency_symbol'],
+      "feed_full_descriptions" : conf['eventbrite']['get_full_descriptions'],
+      "feed_timezone" : conf['feeds']['timezone'],
+      "feed_fragments" : render_feed_items(conf, 'ical', cal_dict, 
+        item_vars),
+      }
+
+    return template_vars
+
+
+# ------------------------------
+def generate_rss(conf, cal_dict, feed_key):
+    """ Given a JSON formatted calendar dictionary, make and return 
+        the RSS file. feed_key should be defined as a feed in the
+        YAML.
+    """
+
+    return "".join(generate_feed_chunks(conf, 'rss', cal_dict, feed_key))
+
+
+# ------------------------------
+def rss_template_vars(conf, cal_dict, feed_key):
+    """ Produce the variables for the RSS feed template. """
+
+    time_now = get_time_now(conf)
+    time_now_formatted = time_now.strftime("%a, %d %b %Y %T %z")
+
+    # Copy and paste. What could go wrong?
+    feed_info = conf['feeds'][feed_key]
+
+    selflink = "{}/{}.rss".format(
+      conf['feeds']['website'],
+      feed_info['name'],
+      )
+
+    item_vars = {
+      "feed_currency" : conf['feeds']['currency_symbol'],
+      "feed_full_descriptions" : conf['eventbrite']['get_full_descriptions'],
+      }
 
-    template = template_env.get_template( RSS_TEMPLATE ) 
     template_vars = { 
       "feed_title": feed_info['title'],
       "feed_description": feed_info['description'],
@@ -713,11 +1797,130 @@ def generate_rss(conf, cal_dict, feed_key):
       "feed_selflink" : selflink,
       "feed_currency" : conf['feeds']['currency_symbol'],
       "feed_full_descriptions" : conf['eventbrite']['get_full_descriptions'],
+      "feed_fragments" : render_feed_items(conf, 'rss', cal_dict, 
+        item_vars),
       }
 
-    output_rss = template.render(template_vars)
+    return template_vars
+
+
+# ------------------------------
+def generate_feed_chunks(conf, kind, cal_dict, feed_key):
+    """ Render the kind ('rss' or 'ical') feed for feed_key a piece at 
+        a time. Produces an iterator of strings, so the whole feed
+        never has to be in memory at once (see publish_feed).
+    """
+
+    if kind == 'rss':
+        template_vars = rss_template_vars(conf, cal_dict, feed_key)
+    else:
+        template_vars = ical_template_vars(conf, cal_dict, feed_key)
+
+    return get_template(conf, kind).generate(template_vars)
+
+
+# ------------------------------
+def publish_feed(chunks, dest):
+    """ Write the strings in chunks to the feed file dest. They go to
+        a temp file next to dest, which is renamed into place at the 
+        end, so a web server never sees half a feed.
+    """
+
+    tmp_file = "{}.tmp".format(dest)
+
+    try:
+        # Insert Windows newlines for dumb email clients
+        with open(tmp_file, "w", newline='\r\n', encoding='utf8') as out:
+            for chunk in chunks:
+                out.write(chunk)
+            out.flush()
+            os.fsync(out.fileno())
+    except BaseException:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        raise
+
+    os.replace(tmp_file, dest)
+
+
+# ------------------------------
+def render_job(index):
+    """ Render and publish _render_jobs[index]. This may run in a 
+        worker process, so produce the fragments it used for the 
+        parent to save.
+    """
+
+    job = _render_jobs[index]
+
+    publish_feed(
+      generate_feed_chunks(
+        job['config'],
+        job['kind'],
+        job['events'],
+        job['feed_key'],
+        ),
+      job['dest'],
+      )
+
+    if _fragment_cache:
+        return _fragment_cache.used
+
+    return {}
 
-    return str(output_rss)
+
+# ------------------------------
+def render_feeds(config, jobs):
+    """ Render and publish each of jobs (dicts with 'kind', 'events', 
+        'feed_key' and 'dest'). The feeds do not depend on each 
+        other, so with feeds.render_workers more than 1 they are 
+        rendered in a pool of forked processes. Small runs (fewer 
+        than feeds.render_parallel_min_items events over all the 
+        feeds) are not worth the forking, and are rendered one after
+        the other. So is everything on systems that cannot fork, or
+        when other threads are still running: a forked child only 
+        gets the thread that forked, and any lock another thread 
+        held stays locked forever.
+    """
+
+    global _render_jobs
+
+    num_workers = config['feeds'].get('render_workers', 1)
+    min_items = config['feeds'].get('render_parallel_min_items', 500)
+    num_items = sum(len(job['events']) for job in jobs)
+
+    parallel = num_workers > 1 and len(jobs) > 1 \
+      and num_items >= min_items \
+      and 'fork' in multiprocessing.get_all_start_methods()
+
+    if parallel and threading.active_count() > 1:
+        logging.info("{} other threads are running. Not forking to "
+          "render the feeds.".format(threading.active_count() - 1))
+        parallel = False
+
+    _render_jobs = [dict(job, config=config) for job in jobs]
+
+    try:
+        if not parallel:
+            for index in range(len(jobs)):
+                render_job(index)
+            return
+
+        logging.info("Rendering {} feeds ({} events) with {} "
+          "processes".format(
+            len(jobs),
+            num_items,
+            min(num_workers, len(jobs)),
+            ))
+
+        with concurrent.futures.ProcessPoolExecutor(
+          max_workers=min(num_workers, len(jobs)),
+          mp_context=multiprocessing.get_context('fork'),
+          ) as executor:
+            for used in executor.map(render_job, range(len(jobs))):
+                if _fragment_cache:
+                    _fragment_cache.used.update(used)
+    finally:
+        _render_jobs = []
 
 ## ------------------------------
 def print_results(events):
@@ -891,10 +2094,6 @@ def load_config_yaml(configfile=None):
     if not config.get('flags'): 
         config['flags'] = {}
 
-    # Set backoff
-    global _current_backoff
-    _current_backoff = config['eventbrite']['backoff_initial']
-
     return config
 
 ## ------------------------------
@@ -935,6 +2134,11 @@ def parse_args():
     parser.add_argument('--dump-dir',
         help='Dump intermediate results in this folder',
         )
+    parser.add_argument('--replay-dir',
+        help='Do not go online. Answer web and API requests from the '
+          'pages and responses saved with --dump-dir in this folder. '
+          'Point the config at a scratch cache_path first!',
+        )
 
     args = parser.parse_args()
 
@@ -984,6 +2188,10 @@ def load_config(configfile=None):
             configuration_lala['paths']['dump_path'] = args.dump_dir
             configuration_lala['flags']['dump'] = True
 
+        if args.replay_dir:
+            configuration_lala['paths']['replay_path'] = args.replay_dir
+            configuration_lala['flags']['replay'] = True
+
     if configuration_lala['flags'].get('dump'):
         config_dump(configuration_lala)
 
@@ -1012,7 +2220,8 @@ def sort_json_events_by_pubdate(events):
 
     sorted_events = sorted(
       events,
-      key=lambda item: item['published'],
+      key=lambda item: item.published if isinstance(item, Event) 
+        else item['published'],
       reverse=True,
       )
 
@@ -1086,7 +2295,7 @@ def merge_and_prune(old_items, update_items):
              "Both lists are finished but should not be!"
              )
 
-        if dateutil.parser.parse(target['end']['utc']) >= too_old:
+        if parse_datetime(target['end']['utc']) >= too_old:
             merged_items.append(target)
         else:
             num_dropped = num_dropped + 1
@@ -1107,18 +2316,18 @@ def merge_and_prune(old_items, update_items):
 
 
 # ------
-def extract_events(page):
-    """ Parse json events from requested page
-    
-    page: a BeautifulSoup object
-
-    returns: a list?
+def events_from_scripts(ld_json_scripts, next_data_script):
+    """ Produce the list of candidate events, given the contents of 
+        every application/ld+json script on a page (a list of strings)
+        and the contents of the __NEXT_DATA__ script (or None). The 
+        __NEXT_DATA__ is only used if there are no ld+json scripts.
+
+        This is the part of extract_events that does not care how
+        the page was parsed.
     """
     candidate_list = []
 
-    event_script = page.find_all(type="application/ld+json")
-
-    num_candidates = len(event_script)
+    num_candidates = len(ld_json_scripts)
     logging.debug("Found {} instances of "
       "application/ld+json on page".format(
         num_candidates,
@@ -1126,8 +2335,8 @@ def extract_events(page):
     
     if num_candidates > 0:
 
-        for candidate in event_script:
-            can_json = json.loads(candidate.string)
+        for candidate in ld_json_scripts:
+            can_json = json.loads(candidate)
 
             # Sigh. The format looks different now.
 
@@ -1161,317 +2370,2274 @@ def extract_events(page):
             elif '@type' in can_json and can_json['@type'] == 'Event':
                 candidate_list.append(can_json)
 
-    else:
-        
-        next_script = page.find('script', id='__NEXT_DATA__')
-        if next_script:
-            logging.debug("Found __NEXT_DATA__ script!")
+    elif next_data_script:
+        logging.debug("Found __NEXT_DATA__ script!")
 
-            # Now we are looking for 
-            # { "props": { "pageProps": ... 
-            #   { "upcomingEvents": [...] }}}
+        # Now we are looking for 
+        # { "props": { "pageProps": ... 
+        #   { "upcomingEvents": [...] }}}
 
-            can_json = json.loads(next_script.string)
+        can_json = json.loads(next_data_script)
 
-            if 'props' in can_json and \
-              'pageProps' in can_json['props'] and \
-              'upcomingEvents' in can_json['props']['pageProps']:
+        if 'props' in can_json and \
+          'pageProps' in can_json['props'] and \
+          'upcomingEvents' in can_json['props']['pageProps']:
 
-                can_list = can_json['props']['pageProps']['upcomingEvents']
-                candidate_list.extend(can_list)
-            else:
-                logging.debug("Could not find upcomingEvents in __NEXT_DATA__")
+            can_list = can_json['props']['pageProps']['upcomingEvents']
+            candidate_list.extend(can_list)
+        else:
+            logging.debug("Could not find upcomingEvents in __NEXT_DATA__")
 
 
     logging.debug("Found {} candidates".format(len(candidate_list)))
     return candidate_list    
-        
-    
-# -------
-def traverse_pages(config, target, json_so_far, page_limit):
-    """ Pull JSON from pages, to desired limit
 
-    target : URL to fetch
-    json_so_far : collected events up to this point
+# ------
+def extract_events(page):
+    """ Parse json events from requested page
+    
+    page: a BeautifulSoup object
+
+    returns: a list?
+    """
+
+    ld_json_scripts = [candidate.string for candidate in
+      page.find_all(type="application/ld+json")]
+
+    next_data_script = None
+    next_script = page.find('script', id='__NEXT_DATA__')
+    if next_script:
+        next_data_script = next_script.string
+
+    return events_from_scripts(ld_json_scripts, next_data_script)
+
+# ------
+def find_script_blocks(text):
+    """ Make a single pass over raw HTML and produce a list of 
+        (attributes, contents) for every <script> block, where 
+        attributes is a dict. Much faster than building a 
+        BeautifulSoup, but it only knows about script tags.
+    """
+
+    blocks = []
+
+    for match in SCRIPT_BLOCK_REGEXP.finditer(text):
+        attributes = {}
+        for attr in SCRIPT_ATTR_REGEXP.finditer(match[1]):
+            value = attr[2]
+            if value is None:
+                value = attr[3]
+            if value is None:
+                value = attr[4]
+            attributes[attr[1].lower()] = value
+
+        blocks.append((attributes, match[2]))
+
+    return blocks
+
+# ------
+def extract_events_fast(text, blocks=None):
+    """ Like extract_events, but works on the raw HTML text using 
+        find_script_blocks. Produces None if it looks like we missed
+        something, in which case the caller should fall back to 
+        BeautifulSoup.
+
+        blocks: find_script_blocks(text), if the caller already has it
+    """
+
+    if blocks is None:
+        blocks = find_script_blocks(text)
+
+    ld_json_scripts = []
+    next_data_script = None
+
+    for attributes, contents in blocks:
+        if attributes.get('type') == "application/ld+json":
+            ld_json_scripts.append(contents)
+        elif attributes.get('id') == "__NEXT_DATA__" \
+          and next_data_script is None:
+            next_data_script = contents
+
+    if not ld_json_scripts and next_data_script is None \
+      and ('application/ld+json' in text or '__NEXT_DATA__' in text):
+        return None
+
+    try:
+        return events_from_scripts(ld_json_scripts, next_data_script)
+    except ValueError as e:
+        logging.debug("extract_events_fast: bad JSON: {}".format(e))
+        return None
+
+# ------
+def find_server_data(page):
+    """ Produce the decoded window.__SERVER_DATA__ blob from a 
+        BeautifulSoup page, or None if there is none.
+    """
+
+    all_js = page.find_all('script', type="text/javascript",
+      recursive=True)
+
+    logging.debug("How many JS? {}".format(len(all_js)))
+
+    for script in all_js:
+        if script.string and 'window.__SERVER_DATA__' in script.string:
+            content = str(script.string)
+            raw_string = re.search(SERVER_DATA_REGEXP, content)
+
+            return json.loads(raw_string[1])
+
+    return None
+
+# ------
+def find_server_data_fast(text, blocks=None):
+    """ Like find_server_data, but works on raw HTML text using 
+        find_script_blocks.
+
+        blocks: find_script_blocks(text), if the caller already has it
+    """
+
+    if blocks is None:
+        blocks = find_script_blocks(text)
+
+    for attributes, contents in blocks:
+        if attributes.get('type') == "text/javascript" \
+          and 'window.__SERVER_DATA__' in contents:
+            raw_string = re.search(SERVER_DATA_REGEXP, contents)
+
+            return json.loads(raw_string[1])
+
+    return None
+
+# ------
+def parse_listing_page(config, text):
+    """ Pull what we need out of the HTML of a listing page. Produces 
+        a tuple:
+          - the list of candidate events
+          - the decoded __SERVER_DATA__ (or None)
+
+        Unless eventbrite.fast_extract is false, try the fast script
+        scanner first and only build a BeautifulSoup if that fails.
+        The page is only scanned once for both.
+    """
+
+    if config['eventbrite'].get('fast_extract', True):
+        blocks = find_script_blocks(text)
+        events = extract_events_fast(text, blocks)
+
+        if events is not None:
+            try:
+                return events, find_server_data_fast(text, blocks)
+            except (TypeError, ValueError) as e:
+                logging.debug("find_server_data_fast failed: {}".format(e))
+
+        logging.info("Fast extraction failed. Using BeautifulSoup.")
+
+    page = BeautifulSoup(text, 'html.parser')
+
+    return extract_events(page), find_server_data(page)
+
+# ------
+def get_validator_dir(config):
+    """ Produce the folder holding HTTP validators (ETag and 
+        Last-Modified) for listing pages, making it if needed. 
+        Produces None if paths.http_cache is not configured, in which
+        case we do not make conditional requests at all.
+    """
+
+    if not config['paths'].get('http_cache'):
+        return None
+
+    validator_dir = get_cache_filename(config, 'http_cache')
+
+    if not os.path.isdir(validator_dir):
+        os.makedirs(validator_dir, exist_ok=True)
+
+    return validator_dir
+
+# ------
+def load_page_validators(config, url):
+    """ Produce the cache entry saved for url the last time we 
+        downloaded it, or None. The entry is a dict with the 'etag' 
+        and 'last_modified' validators and the 'events' we extracted 
+        from the page.
+    """
+
+    validator_dir = get_validator_dir(config)
+    if not validator_dir:
+        return None
+
+    entry_file = os.path.join(
+      validator_dir, 
+      "{}.json".format(url_to_filename(url)),
+      )
+
+    if not os.path.isfile(entry_file):
+        return None
+
+    try:
+        with open(entry_file, "r", encoding='utf8') as infile:
+            return json.load(infile)
+    except ValueError as e:
+        logging.warning("Ignoring corrupt validator file {}: {}".format(
+          entry_file,
+          e,
+          ))
+        return None
+
+# ------
+def conditional_headers(cached):
+    """ Produce the If-None-Match/If-Modified-Since headers for a 
+        cache entry from load_page_validators (which may be None).
+    """
+
+    headers = {}
+
+    if cached:
+        if cached.get('etag'):
+            headers['If-None-Match'] = cached['etag']
+        if cached.get('last_modified'):
+            headers['If-Modified-Since'] = cached['last_modified']
+
+    return headers
+
+# ------
+def save_page_validators(config, url, response, events, page_count=None):
+    """ Remember the validators from response along with the events
+        (and page_count, if known) we extracted, so a later 304 can 
+        reuse them. Pages that come without validators are not saved.
+    """
+
+    validator_dir = get_validator_dir(config)
+    if not validator_dir:
+        return
+
+    etag = response.headers.get('ETag')
+    last_modified = response.headers.get('Last-Modified')
+
+    if not etag and not last_modified:
+        return
+
+    entry_file = os.path.join(
+      validator_dir, 
+      "{}.json".format(url_to_filename(url)),
+      )
+
+    # Write and rename, so a crash does not leave half an entry
+    tmp_file = "{}.tmp".format(entry_file)
+    with open(tmp_file, "w", encoding='utf8') as out:
+        json.dump({
+          'url': url,
+          'etag': etag,
+          'last_modified': last_modified,
+          'events': events,
+          'page_count': page_count,
+          }, out)
+    os.replace(tmp_file, entry_file)
+
+# -------
+def page_count_from_server_data(target, data):
+    """ Produce the number of pages of events for target according 
+        to its window.__SERVER_DATA__ (already decoded), or None if 
+        it does not say.
+    """
+
+    # Update 2022-08-30: on 2022-07-27 Eventbrite changed 
+    # something, and this div disappeared from the interface.
+
+    # Update 2024-04-27: On 2024-04-24 Eventbrite changed something 
+    # else around pagination. They now say there are 500 pages total.
+    # We never get a 404 when running out of events any more.
+    #
+    # Worse this does not get generated until some JS runs, I think.
+
+    # Update 2024-05-01: There is a 'window.__SERVER_DATA__' entry
+    # that contains both the pagination (if it exists) and the
+    # type of the page (discovery, organization, etc). If we can 
+    # get this information we can stop guessing.
+
+    if data is None:
+        return None
+
+    if 'app_name' in data:
+        logging.debug("{}: app_name is {}".format(
+          target,
+          data['app_name'],
+          ))
+    else:
+        logging.debug("{}: Uh oh! No app_name found!".format(
+          target,
+          ))
+     
+    if 'page_count' in data:
+        logging.debug("{}: Page count is {}".format(
+          target,
+          data['page_count'],
+          ))
+        return data['page_count']
+
+    return None
+
+# -------
+def traverse_pages(config, target, json_so_far, page_limit,
+  known_ids=None, stop_after_known=0):
+    """ Pull JSON from pages, to desired limit
+
+    target : URL to fetch
+    json_so_far : collected events up to this point
     page_limit: maximum pages to consume (determined by us)
+    known_ids: IDs of events we already have (eg the keys of 
+      event_dict), or None
+    stop_after_known: if positive (and known_ids is given), stop 
+      after this many pages in a row with no new events on them
+
+    The first page also tells us how many pages there are, so
+    we never fetch past that (or past page_limit).
+    """
+
+    if config['flags'].get('dump'):
+        htmldir = ensure_dumpdir(config, "html-pages")
+        jsondir = ensure_dumpdir(config, "json-from-html")
+
+    curr_page = 1
+    keep_going = True
+    last_json = json_so_far
+    new_json = None
+
+    # For incremental crawls
+    seen_ids = set()
+    known_streak = 0
+    while (curr_page <= page_limit) \
+      and keep_going:
+        
+
+        if curr_page == 1:
+            payload = {}
+        else:
+            payload = {'page': curr_page}
+
+        request_url = requests.Request(
+          'GET', target, params=payload).prepare().url
+
+        # A 304 has no page to capture, so a --dump-dir run always 
+        # asks for the whole thing. Otherwise replaying it would come
+        # up short.
+        cached = None
+        if not config['flags'].get('dump'):
+            cached = load_page_validators(config, request_url)
+
+        try:
+            r = rate_limited_request(config, 'scrape', 'GET', target, 
+              params=payload,
+              headers=conditional_headers(cached),
+              )
+            r.raise_for_status()
+            if curr_page != 1:
+                logging.info("Fetched page {}: {}".format(
+                  curr_page, 
+                  r.url,
+                  ))
+            else:
+                logging.info("{}: Got initial data".format(target))
+        except requests.exceptions.HTTPError as e:
+            # rate_limited_request already waited out any 429s it 
+            # could, so this is final.
+            logging.warn("Oy. Received status {}, error '{}' for"
+              "url {} on page {}.  Bailing".format(
+                r.status_code,
+                e,
+                r.url,
+                curr_page,
+                )) 
+            return json_so_far
+        except requests.exceptions.RequestException as e:
+            # Timeouts, dropped connections and the like. Keep what
+            # we have so far.
+            logging.warning("Could not fetch {} on page {}: {}. "
+              "Bailing".format(
+                target,
+                curr_page,
+                e,
+                ))
+            return json_so_far
+
+        if r.status_code == 304 and cached is not None:
+            # Nothing changed since last time, so skip the parse
+            logging.info("{}: Not modified. Reusing {} events".format(
+              request_url,
+              len(cached['events']),
+              ))
+            new_json = cached['events']
+            page_count = cached.get('page_count')
+        else:
+            new_json, server_data = parse_listing_page(config, r.text)
+            page_count = page_count_from_server_data(target, server_data)
+
+            save_page_validators(config, request_url, r, new_json, 
+              page_count)
+
+            if config['flags'].get('dump'):
+                # Named for what we asked for, not where a redirect
+                # took us, since that is what a replay asks for
+                filename = capture_filename(request_url)[1]
+                dump_file(r.text, htmldir, filename, "html")
+                dump_file(new_json, jsondir, filename, "json")
+
+        if curr_page == 1:
+            if page_count is None:
+                page_count = 1
+                logging.debug("{}: did not find pagination."
+                  " Assuming {}".format(
+                    target,
+                    page_count,
+                    ))
+            page_limit = min(page_limit, page_count)
+
+
+        if new_json and new_json == last_json:
+            keep_going = False
+            logging.info("Found duplicate set of events."
+              "Assuming we are done. {}".format(
+                curr_page
+                ))
+
+        if new_json: 
+            last_json = new_json
+            json_so_far = json_so_far + new_json
+
+        if known_ids is not None and stop_after_known > 0:
+            new_ids = event_ids(new_json) - known_ids - seen_ids
+            seen_ids.update(new_ids)
+
+            if new_ids:
+                known_streak = 0
+            else:
+                known_streak = known_streak + 1
+
+            if keep_going and known_streak >= stop_after_known:
+                keep_going = False
+                logging.info("{}: {} pages in a row with nothing new. "
+                  "Stopping at page {}".format(
+                    target,
+                    known_streak,
+                    curr_page,
+                    ))
+
+
+        curr_page = curr_page + 1
+
+    logging.info("Traversed {} pages".format(curr_page - 1))
+    
+    return json_so_far
+
+# ----------------------------
+def host_semaphore(config, url):
+    """ Produce the semaphore that limits how many requests we send to 
+        the host of url at the same time. There is one semaphore per 
+        host, shared by every crawl thread.
+    """
+
+    host = urlparse(url).netloc
+
+    with _host_semaphores_lock:
+        if host not in _host_semaphores:
+            _host_semaphores[host] = threading.BoundedSemaphore(
+              config['eventbrite'].get('max_requests_per_host', 1)
+              )
+
+        return _host_semaphores[host]
+
+# ----------------------------
+def event_ids(events):
+    """ Produce the set of IDs of a list of scraped events, skipping
+        any without a sensible URL.
+    """
+
+    ids = set()
+
+    for event in events or []:
+        try:
+            ids.add(url_to_id(event['url']))
+        except (KeyError, NoEventbriteIDException):
+            pass
+
+    return ids
+
+# ----------------------------
+def get_targets(config):
+    """ Produce the target_urls from the config as a list of dicts, 
+        each with 'url', 'max_pages_to_fetch' and 
+        'stop_after_known_pages'. Entries in the YAML may be plain 
+        URLs (which get the global settings) or dicts that override
+        some of them.
+    """
+
+    defaults = {
+      'max_pages_to_fetch': config['eventbrite']['max_pages_to_fetch'],
+      'stop_after_known_pages': 
+        config['eventbrite'].get('stop_after_known_pages', 0),
+      }
+
+    targets = []
+
+    for entry in config['eventbrite']['target_urls']:
+        target = dict(defaults)
+
+        if isinstance(entry, dict):
+            target.update(entry)
+        else:
+            target['url'] = entry
+
+        targets.append(target)
+
+    return targets
+
+# ----------------------------
+def crawl_target(config, target, known_ids=None):
+    """ Download all the events for one entry of get_targets(). 
+        Produces a list of JSON elements (which is empty if the 
+        target could not be fetched).
+
+        If known_ids is given, then stop paging once 
+        stop_after_known_pages pages in a row have nothing new.
+    """
+
+    events = traverse_pages(
+      config,
+      target['url'], 
+      [], 
+      target['max_pages_to_fetch'],
+      known_ids,
+      target['stop_after_known_pages'],
+      )
+    logging.info("{}: Got {} items!".format(
+      target['url'],
+      len(events))
+      )
+
+    return events
+
+# ----------------------------
+def download_events(config, known_ids=None):
+    """ Download events. Produces a list of JSON elements.
+        Consumes the configuration dict, and optionally the set of 
+        event IDs we already know about (for incremental crawls).
+
+        If crawl_workers is bigger than 1 then the targets are 
+        crawled in parallel threads. The merged list is in the same 
+        order as target_urls either way.
+    """
+
+    all_events = json.loads('[]')
+
+    targets = get_targets(config)
+    num_workers = min(
+      config['eventbrite'].get('crawl_workers', 1),
+      len(targets),
+      )
+
+    if num_workers > 1:
+        logging.info("Crawling {} targets with {} workers".format(
+          len(targets),
+          num_workers,
+          ))
+        with concurrent.futures.ThreadPoolExecutor(
+          max_workers=num_workers) as executor:
+            results = list(executor.map(
+              lambda target: crawl_target(config, target, known_ids),
+              targets,
+              ))
+    else:
+        results = [crawl_target(config, target, known_ids) 
+          for target in targets]
+
+    for events in results:
+        all_events = all_events + events
+
+    return all_events
+
+# -----------------------------
+def scraped_datetime(event, keys, timezone):
+    """ Produce an aware datetime from the first of keys (eg 
+        ['endDate', 'end_date']) that is in a scraped event, or None.
+        Naive dates are assumed to be in timezone.
+    """
+
+    for key in keys:
+        if key in event:
+            d = parse_datetime(event[key])
+
+            if d.tzinfo is None or d.tzinfo.utcoffset(d) is None:
+                return timezone.localize(d)
+
+            return d
+
+    return None
+
+# -----------------------------
+def scraped_organizer_id(event):
+    """ Guess the organizer ID of a scraped event, so we can tell if it
+        is filtered before spending API calls on it. Produces None if
+        we cannot tell.
+    """
+
+    for key in ['primary_organizer_id', 'organizer_id']:
+        if event.get(key):
+            return str(event[key])
+
+    organizer = event.get('organizer')
+    if isinstance(organizer, dict) and organizer.get('url'):
+        # eg https://www.eventbrite.ca/o/some-organizer-6827056193
+        match = re.search(r'-(\d+)/?$', organizer['url'])
+        if match:
+            return match[1]
+
+    return None
+
+# -----------------------------
+def scraped_instance_times(event, timezone):
+    """ Produce (start, end) aware datetimes of a scraped event, or 
+        None unless both have a time of day as well as a date. 
+        __NEXT_DATA__ events keep the date and time separately (and 
+        may have their own timezone). Naive times are assumed to be 
+        in timezone.
+    """
+
+    times = []
+
+    try:
+        for which in ['start', 'end']:
+            if '@type' in event:
+                when = event.get("{}Date".format(which), "")
+                if "T" not in when:
+                    return None
+            else:
+                if not event.get("{}_time".format(which)):
+                    return None
+                when = "{} {}".format(
+                  event["{}_date".format(which)],
+                  event["{}_time".format(which)],
+                  )
+                if event.get('timezone'):
+                    timezone = get_timezone(event['timezone'])
+
+            times.append(scraped_datetime({'when': when}, ['when'], 
+              timezone))
+
+    except (KeyError, ValueError, OverflowError, 
+      pytz.exceptions.UnknownTimeZoneError):
+        return None
+
+    return tuple(times)
+
+# -----------------------------
+def series_key(event):
+    """ Produce something that is the same for every scraped event in 
+        a recurring series, or None if we cannot tell. That is the 
+        series_id if the listing gives one, or else the name, organizer
+        and venue together. 
+    """
+
+    if event.get('series_id'):
+        return ('series', str(event['series_id']))
+
+    organizer = scraped_organizer_id(event)
+    if not organizer or not event.get('name'):
+        return None
+
+    location = event.get('location') or event.get('primary_venue_id') \
+      or event.get('primary_venue')
+
+    return ('match', json.dumps(event['name']), organizer, 
+      json.dumps(location, sort_keys=True))
+
+# -----------------------------
+def group_series(candidates, timezone):
+    """ Find recurring series in candidates (tuples from 
+        incorporate_events). Produces a dict from the ID of each 
+        event that can be derived from another to the ID of the event
+        to fetch (the first one we saw in its series).
+    """
+
+    series = {}
+
+    for (id, event, end_date, too_far, virtual) in candidates:
+        key = series_key(event)
+        if key is None or scraped_instance_times(event, timezone) is None:
+            continue
+        series.setdefault(key, []).append(id)
+
+    series_of = {}
+    for ids in series.values():
+        for id in ids[1:]:
+            series_of[id] = ids[0]
+
+    if series_of:
+        logging.info("{} events are instances of series we are "
+          "fetching anyways".format(len(series_of)))
+
+    return series_of
+
+# -----------------------------
+def derive_series_event(api_event, event, timezone, now):
+    """ Make the API event for scraped event out of api_event, the 
+        API event for another instance of its series. The organizer,
+        venue, prices and description are shared, so the ID, URL and
+        times are changed. 
+
+        Whether tickets are left (sold out, waitlist...) belongs to 
+        the instance we fetched, so only the prices are kept from its
+        ticket_availability. Its created, changed and published dates
+        are replaced too: as far as we know this instance is new as 
+        of now, and it sorts that way in the feeds.
+
+        Pre: scraped_instance_times(event, timezone) is not None
+    """
+
+    start, end = scraped_instance_times(event, timezone)
+
+    derived = copy.deepcopy(api_event)
+    derived['id'] = url_to_id(event['url'])
+    derived['url'] = event['url']
+
+    if 'ticket_availability' in derived:
+        derived['ticket_availability'] = {key: value 
+          for key, value in derived['ticket_availability'].items()
+          if key in SERIES_SHARED_TICKET_KEYS}
+
+    derived_at = datetime_to_utc_string(now)
+    for key in ['created', 'changed', 'published']:
+        derived[key] = derived_at
+
+    for key, when in [('start', start), ('end', end)]:
+        tz_name = api_event.get(key, {}).get('timezone') or timezone.zone
+        derived[key] = {
+          'timezone': tz_name,
+          'local': when.astimezone(get_timezone(tz_name)).strftime(
+            "%Y-%m-%dT%H:%M:%S"),
+          'utc': datetime_to_utc_string(when),
+          }
+
+    return derived
+
+# -----------------------------
+def fingerprint_source(event):
+    """ Which kind of listing did a scraped event come from? 
+        application/ld+json events have an '@type', and __NEXT_DATA__ 
+        events do not. The two kinds describe the same event 
+        differently, so their fingerprints are kept separately.
+    """
+
+    if '@type' in event:
+        return 'ld'
+
+    return 'next'
+
+# -----------------------------
+def event_fingerprint(event):
+    """ Produce a hash of the parts of a scraped event that matter 
+        to the feeds (name, dates, description, venue and price). If
+        it changes then the event was edited and is worth fetching
+        from the API again.
+    """
+
+    parts = {key: event.get(key) for key in FINGERPRINT_KEYS 
+      if key in event}
+
+    return hashlib.sha1(
+      json.dumps(parts, sort_keys=True).encode('utf8')
+      ).hexdigest()
+
+# -----------------------------
+def load_api_budget(config):
+    """ Load the API budget state saved by save_api_budget. This is a
+        dict with:
+          - 'calls': time.time() of every API call in the last hour 
+            (across runs)
+          - 'queue': scraped events (by ID) we wanted to fetch but 
+            could not afford, to try again next run
+
+        If paths.api_budget_file is not set, produce an empty state.
+    """
+
+    budget = {'calls': [], 'queue': {}}
+
+    if not config['paths'].get('api_budget_file'):
+        return budget
+
+    budget_file = get_cache_filename(config, 'api_budget_file')
+
+    if os.path.isfile(budget_file):
+        try:
+            with open(budget_file, "r", encoding='utf8') as infile:
+                budget.update(json.load(infile))
+        except ValueError as e:
+            logging.warning("Ignoring corrupt budget file {}: {}".format(
+              budget_file,
+              e,
+              ))
+
+    an_hour_ago = time.time() - 3600
+    budget['calls'] = [t for t in budget['calls'] if t >= an_hour_ago]
+
+    return budget
+
+# -----------------------------
+def save_api_budget(config, budget):
+    """ Add the API calls made this run to budget and save it, if 
+        paths.api_budget_file is set.
+    """
+
+    global _api_call_times
+
+    with _num_api_calls_lock:
+        budget['calls'] = budget['calls'] + _api_call_times
+        _api_call_times = []
+
+    if not config['paths'].get('api_budget_file'):
+        return
+
+    an_hour_ago = time.time() - 3600
+    budget['calls'] = [t for t in budget['calls'] if t >= an_hour_ago]
+
+    budget_file = get_cache_filename(config, 'api_budget_file')
+
+    tmp_file = "{}.tmp".format(budget_file)
+    with open(tmp_file, "w", encoding='utf8') as out:
+        json.dump(budget, out)
+    os.replace(tmp_file, budget_file)
+
+    logging.info("API budget: {} calls in the last hour, {} events "
+      "queued for next run".format(
+        len(budget['calls']),
+        len(budget['queue']),
+        ))
+
+# -----------------------------
+def load_negative_cache(config):
+    """ Load the negative cache saved by save_negative_cache. This is 
+        a dict indexed by event ID, of dicts with:
+          - 'reason': a key of NEGATIVE_CACHE_TTLS
+          - 'until': time.time() after which we look at the event again
+          - 'failures': how many API calls in a row failed for it
+
+        If paths.negative_cache_file is not set, produce an empty dict.
+    """
+
+    if not config['paths'].get('negative_cache_file'):
+        return {}
+
+    cache_file = get_cache_filename(config, 'negative_cache_file')
+
+    if not os.path.isfile(cache_file):
+        return {}
+
+    try:
+        with open(cache_file, "r", encoding='utf8') as infile:
+            return json.load(infile)
+    except ValueError as e:
+        logging.warning("Ignoring corrupt negative cache {}: {}".format(
+          cache_file,
+          e,
+          ))
+        return {}
+
+# -----------------------------
+def negative_cache_ids(config):
+    """ Produce the set of IDs the negative cache says to skip right 
+        now. incorporate_events will not look at them, so for an 
+        incremental crawl they are as good as known.
+    """
+
+    now_seconds = time.time()
+
+    return set(id for id, entry in load_negative_cache(config).items()
+      if entry['until'] > now_seconds)
+
+# -----------------------------
+def save_negative_cache(config, negative_cache):
+    """ Save negative_cache, if paths.negative_cache_file is set. 
+        Entries that ran out a long time ago are dropped. (We keep 
+        them for a while so failures in a row can be counted.)
+    """
+
+    if not config['paths'].get('negative_cache_file'):
+        return
+
+    max_seconds = 3600 * config['eventbrite'].get(
+      'negative_cache_max_hours', 24 * 7)
+    too_old = time.time() - max_seconds
+
+    negative_cache = {id: entry for id, entry in negative_cache.items()
+      if entry['until'] >= too_old}
+
+    cache_file = get_cache_filename(config, 'negative_cache_file')
+
+    tmp_file = "{}.tmp".format(cache_file)
+    with open(tmp_file, "w", encoding='utf8') as out:
+        json.dump(negative_cache, out)
+    os.replace(tmp_file, cache_file)
+
+# -----------------------------
+def api_failure_reason(status):
+    """ Which NEGATIVE_CACHE_TTLS reason goes with a failed API call 
+        that got this HTTP status (or None)?
+    """
+
+    if status in [404, 410]:
+        return 'not_found'
+    if status in [401, 403]:
+        return 'forbidden'
+    return 'api_error'
+
+# -----------------------------
+def remember_negative(config, negative_cache, id, reason):
+    """ Note in negative_cache that event id is not worth looking at
+        for a while, because of reason. 
+    """
+
+    ttls = dict(NEGATIVE_CACHE_TTLS)
+    ttls.update(config['eventbrite'].get('negative_cache_ttls', {}))
+
+    failures = 0
+    if reason in ['not_found', 'forbidden', 'api_error']:
+        failures = negative_cache.get(id, {}).get('failures', 0) + 1
+
+    hours = ttls[reason] * (2 ** max(failures - 1, 0))
+    hours = min(hours, 
+      config['eventbrite'].get('negative_cache_max_hours', 24 * 7))
+
+    negative_cache[id] = {
+      'reason': reason,
+      'until': time.time() + 3600 * hours,
+      'failures': failures,
+      }
+
+# -----------------------------
+def plan_enrichment(config, budget, candidates):
+    """ Decide which candidates (tuples from incorporate_events) we
+        can afford to fetch from the API this run. Produces a tuple of
+        lists: (fetch now, defer to next run).
+
+        The most valuable events go first: in-boundary before 
+        virtual, unfiltered organizers before filtered ones, and then
+        the soonest start date. We spend at most api_budget_per_run 
+        calls, and never go over api_hourly_limit counting the calls
+        already made in the last hour.
+
+        If api_hourly_limit is not set then everything is fetched.
+    """
+
+    hourly_limit = config['eventbrite'].get('api_hourly_limit')
+    if not hourly_limit:
+        return candidates, []
+
+    timezone = get_timezone(config['feeds']['timezone'])
+    filtered_organizers = config['eventbrite']['filtered_organizers']
+    far_future = datetime.datetime.max.replace(tzinfo=pytz.utc)
+
+    def priority(candidate):
+        (id, event, end_date, too_far, virtual) = candidate
+
+        try:
+            start_date = scraped_datetime(
+              event, ['startDate', 'start_date'], timezone)
+        except (ValueError, OverflowError):
+            start_date = None
+
+        return (
+          virtual,
+          scraped_organizer_id(event) in filtered_organizers,
+          start_date or far_future,
+          )
+
+    ordered = sorted(candidates, key=priority)
+
+    cost_per_event = 1
+    if config['eventbrite']['get_full_descriptions']:
+        cost_per_event = 2
+
+    available = hourly_limit - len(budget['calls'])
+    per_run = config['eventbrite'].get('api_budget_per_run')
+    if per_run:
+        available = min(available, per_run)
+
+    num_to_fetch = max(0, available // cost_per_event)
+
+    if num_to_fetch < len(ordered):
+        logging.info("Can only afford {} of {} new events this run "
+          "({} API calls available)".format(
+            num_to_fetch,
+            len(ordered),
+            available,
+            ))
+
+    return ordered[:num_to_fetch], ordered[num_to_fetch:]
+
+# -----------------------------
+def incorporate_events(config, event_dict, new_events):
+    """ Incorporate new events into event_dict, if they are worthy.
+
+        config: the config dict
+        event_dict: indexed by event ID
+        new_events: raw downloaded events
+
+        First we decide which events are worth an API call, then we 
+        fetch them all at once (see get_events_from_api), then we 
+        add them to event_dict in the order they were downloaded.
+
+        With series_enrichment on, only one new event of each 
+        recurring series is fetched, and the others are made from 
+        it (see group_series).
+    """
+
+    timezone = get_timezone(config['feeds']['timezone'])
+    now = get_time_now(config)
+    recent = now - datetime.timedelta(days=1)
+
+    # Events we could not afford last time get another chance
+    budget = load_api_budget(config)
+    new_events = list(new_events) + list(budget['queue'].values())
+
+    negative_cache = load_negative_cache(config)
+    now_seconds = time.time()
+
+    # (id, event, end_date, too_far, virtual) to add to event_dict
+    candidates = []
+    seen_ids = set()
+
+    for event in new_events:
+        id = url_to_id(event['url'])
+        too_far = False
+        virtual = False
+
+        if id in negative_cache and \
+          negative_cache[id]['until'] > now_seconds:
+            logging.debug("{}: skipped ({})".format(
+              id, 
+              negative_cache[id]['reason'],
+              ))
+            continue
+
+        # Make an aware date 
+        end_date = scraped_datetime(event, ['endDate', 'end_date'], 
+          timezone)
+
+        if end_date < recent:
+            logging.debug("{}: ends {} and now is {}. Past?".format(
+              id,
+              end_date,
+              recent))
+            remember_negative(config, negative_cache, id, 'past')
+            continue
+
+        if event_is_virtual(event):
+            virtual = True 
+        elif not event_in_boundary(config, event):
+            too_far = True
+            remember_negative(config, negative_cache, id, 'too_far')
+
+
+        if id in seen_ids:
+            continue
+
+        seen_ids.add(id)
+
+        if id in event_dict:
+            # Only spend API calls on it again if the listing changed
+            source = fingerprint_source(event)
+            fingerprint = event_fingerprint(event)
+            old_event = event_dict[id]
+            old_fingerprints = old_event['extrainfo'].get('fingerprints', {})
+
+            if old_fingerprints.get(source) == fingerprint:
+                logging.debug("Event {} already in event_dict".format(id))
+                continue
+
+            if source not in old_fingerprints:
+                # Nothing to compare against yet. Remember it for 
+                # next time.
+                updated_event = dict(old_event)
+                updated_event['extrainfo'] = dict(old_event['extrainfo'])
+                updated_event['extrainfo']['fingerprints'] = dict(
+                  old_fingerprints)
+                updated_event['extrainfo']['fingerprints'][source] = \
+                  fingerprint
+                event_dict[id] = updated_event
+                continue
+
+            logging.info("Event {} changed. Refreshing".format(id))
+
+        candidates.append((id, event, end_date, too_far, virtual))
+
+    # Refreshed events might have been changed one by one, so only 
+    # new ones are grouped.
+    series_of = {}
+    if config['eventbrite'].get('series_enrichment'):
+        series_of = group_series(
+          [candidate for candidate in candidates 
+            if not candidate[3] and candidate[0] not in event_dict],
+          timezone,
+          )
+
+    to_fetch, deferred = plan_enrichment(
+      config, 
+      budget,
+      [candidate for candidate in candidates 
+        if not candidate[3] and candidate[0] not in series_of],
+      )
+
+    api_events = get_events_from_api(
+      config,
+      [candidate[0] for candidate in to_fetch],
+      )
+    api_failures = pop_api_failures()
+
+    # The API did not get to these, so they are not failures. Try 
+    # again next run.
+    retry_ids = set(id for id in pop_api_deferred() 
+      if id in api_events and api_events[id] is None)
+    deferred = deferred + [candidate for candidate in to_fetch 
+      if candidate[0] in retry_ids]
+
+    for id, api_event in api_events.items():
+        if id in retry_ids:
+            continue
+
+        if api_event is None:
+            remember_negative(config, negative_cache, id, 
+              api_failure_reason(api_failures.get(id)))
+        else:
+            negative_cache.pop(id, None)
+
+    # The rest of a series goes wherever its fetched event went
+    deferred_ids = set(candidate[0] for candidate in deferred)
+    for candidate in candidates:
+        id = candidate[0]
+        if id not in series_of:
+            continue
+
+        series_api_event = api_events.get(series_of[id])
+
+        if series_of[id] in deferred_ids:
+            deferred.append(candidate)
+        elif series_api_event is None:
+            api_events[id] = None
+        else:
+            api_events[id] = derive_series_event(
+              series_api_event, 
+              candidate[1], 
+              timezone,
+              now,
+              )
+
+    budget['queue'] = {id: event 
+      for (id, event, end_date, too_far, virtual) in deferred}
+
+    for (id, event, end_date, too_far, virtual) in candidates:
+        filtered = False
+
+        if id in budget['queue']:
+            continue
+
+        if not too_far:
+            api_event = api_events[id]
+
+            if api_event is None:
+                # Something went bad. Better bail 
+                logging.warn("API call failed. Stopping fetch.")
+                continue
+
+            # TODO: Check against blacklist and mark as filtered
+            if api_event["organizer_id"] in \
+              config['eventbrite']['filtered_organizers']:
+                filtered = True
+        else:
+            # Make a dummy event cheaply
+            api_event = {}
+
+
+            api_event['end'] = {
+              'utc': end_date.strftime("%FT%H:%M:%SZ")
+              }
+
+        # Keep what we knew about a refreshed event
+        old_extrainfo = {}
+        if id in event_dict:
+            old_extrainfo = event_dict[id]['extrainfo']
+            release_description(event_dict[id])
+
+        store_description(api_event)
+
+        fingerprints = dict(old_extrainfo.get('fingerprints', {}))
+        fingerprints[fingerprint_source(event)] = event_fingerprint(event)
+
+        api_event['extrainfo'] = { 
+          'too_far' : too_far,
+          'filtered_out' : filtered,
+          'virtual' : virtual,
+          'added' : old_extrainfo.get('added', now.strftime("%FT%T")),
+          'fingerprints' : fingerprints,
+          }
+
+        if id in series_of:
+            api_event['extrainfo']['series_of'] = series_of[id]
+
+        api_event['pulled_event'] = event
+
+        event_dict[id] = api_event
+
+    save_api_budget(config, budget)
+    save_negative_cache(config, negative_cache)
+
+# =========================
+# EVENTS
+
+class Event(collections.abc.Mapping):
+    """ A processed event on its way to the feeds. The fields the 
+        pipeline keeps asking about are worked out once, when the 
+        Event is made:
+          - id
+          - start, end: aware datetimes (start is None if unknown)
+          - published: the string from the API (ISO 8601 UTC, so 
+            it sorts as a string)
+          - virtual, too_far, filtered: the flags from extrainfo
+          - latitude, longitude: floats from the venue, or None
+
+        start and the coordinates are worked out the first time 
+        someone asks, so picking events from a CompactEventStore does
+        not decode every LazyEvent.
+
+        Everything else is in raw, the event as it was cached. An 
+        Event acts like raw (event['name']['text'] and so on), so 
+        the templates and json.dump do not need to know about it.
+
+        __slots__ keeps these small, since there is one per cached 
+        event in a run.
+    """
+
+    __slots__ = ('id', '_start', 'end', 'published', 'virtual', 
+      'too_far', 'filtered', '_coordinates', 'raw')
+
+    def __init__(self, id, raw):
+        self.id = id
+        self.raw = raw
+
+        self.end = parse_datetime(raw['end']['utc'])
+        self.published = raw.get('published')
+
+        extrainfo = raw['extrainfo']
+        self.virtual = bool(extrainfo.get('virtual'))
+        self.too_far = bool(extrainfo.get('too_far'))
+        self.filtered = bool(extrainfo.get('filtered_out'))
+
+        self._start = None
+        self._coordinates = None
+
+    @property
+    def start(self):
+        if self._start is None and self.raw.get('start', {}).get('utc'):
+            self._start = parse_datetime(self.raw['start']['utc'])
+        return self._start
+
+    def coordinates(self):
+        """ Produce (latitude, longitude) of the venue, or 
+            (None, None).
+        """
+
+        if self._coordinates is None:
+            self._coordinates = (None, None)
+            venue = self.raw.get('venue')
+            if venue and venue.get('latitude') and venue.get('longitude'):
+                self._coordinates = (
+                  float(venue['latitude']), 
+                  float(venue['longitude']),
+                  )
+
+        return self._coordinates
+
+    @property
+    def latitude(self):
+        return self.coordinates()[0]
+
+    @property
+    def longitude(self):
+        return self.coordinates()[1]
+
+    def __getitem__(self, key):
+        return self.raw[key]
+
+    def __iter__(self):
+        return iter(self.raw)
+
+    def __len__(self):
+        return len(self.raw)
+
+    def __repr__(self):
+        return "Event({!r}, end={})".format(self.id, self.end)
+
+    def to_dict(self):
+        """ The raw event as a plain dict. """
+        if isinstance(self.raw, LazyEvent):
+            return self.raw.to_dict()
+        return dict(self.raw)
+
+# -------------------------
+def partition_events(event_dict, too_old):
+    """ Sort the events in event_dict (or anything with .items()) 
+        into piles of Events. Produces a tuple of lists:
+          - non-filtered events
+          - filtered events
+          - virtual events
+          - IDs of events that ended before too_old
+
+        Events that are too far away are in none of these.
+    """
+
+    ids_to_delete = []
+    non_filtered_events = []
+    filtered_events = []
+    virtual_events = []
+
+    for id, raw_event in event_dict.items():
+        event = Event(id, raw_event)
+
+        if event.end < too_old:
+            ids_to_delete.append(id)
+            logging.debug("Dropped event {} with end time {}".format(
+              id,
+              event.end,
+              ))
+        elif event.virtual:
+            virtual_events.append(event)
+        elif event.too_far:
+            continue
+        elif event.filtered:
+            filtered_events.append(event)
+        else:
+            non_filtered_events.append(event)
+
+    return non_filtered_events, filtered_events, \
+      virtual_events, ids_to_delete
+
+# =========================
+# EVENT STORES
+#
+# An event store holds the processed events between runs. It acts 
+# like the old event_dict (a dict indexed by event ID), and also 
+# knows how to load and save itself. Pick one with 
+# paths.cache_backend and make it with open_event_store().
+
+class EventStore(abc.ABC):
+    """ Base class for event stores. Subclasses provide the dict 
+        methods, load() and save(). The other methods have slow but
+        correct defaults that subclasses can replace with something 
+        smarter.
+    """
+
+    @abc.abstractmethod
+    def load(self):
+        """ Read the events in. """
+
+    @abc.abstractmethod
+    def save(self):
+        """ Write out every change since load(). """
+
+    def wait(self):
+        """ Wait for any work save() left running in the background. """
+        pass
+
+    def close(self):
+        pass
+
+    def partition(self, too_old):
+        """ See partition_events. """
+        return partition_events(self, too_old)
+
+    def delete_ids(self, ids):
+        for id in ids:
+            del self[id]
+
+# -------------------------
+class JsonEventStore(dict, EventStore):
+    """ The original format: the whole event_dict as one JSON file. """
+
+    def __init__(self, filename):
+        super().__init__()
+        self.filename = filename
+
+    def load(self):
+        if os.path.isfile(self.filename):
+            with open(self.filename, "r", encoding='utf8') as injson:
+                self.update(json.load(injson))
+
+    def save(self):
+        with open(self.filename, "w", encoding='utf8') as out_events:
+            json.dump(self, out_events, indent=2, separators=(',', ': '))
+
+# -------------------------
+class JournalEventStore(dict, EventStore):
+    """ Like JsonEventStore, but changes are appended to a journal 
+        instead of rewriting the whole file every run. The cache_file 
+        becomes a snapshot, and the journal (cache_file + '.journal')
+        has one JSON record per line:
+          {"op": "put", "id": ..., "event": {...}}
+          {"op": "del", "id": ...}
+
+        Loading reads the snapshot and replays the journal. When the
+        journal gets big compared to the snapshot, it is compacted: a 
+        new snapshot is written to a temp file and renamed into place, 
+        then the journal is cut back to whatever was written since. 
+        Records are whole events, so replaying a journal over a 
+        snapshot that already has those changes does no harm. That 
+        means a crash at any point leaves something we can load.
+    """
+
+    def __init__(self, filename, compact_ratio=0.5, background=True):
+        super().__init__()
+        self.filename = filename
+        self.journal_filename = "{}.journal".format(filename)
+        self.compact_ratio = compact_ratio
+        self.background = background
+        self.dirty = {}
+        self.lock = threading.Lock()
+        self.compactor = None
+
+    # The compactor copies the dict under the lock, so every change 
+    # has to take it too
+    def __setitem__(self, id, event):
+        with self.lock:
+            super().__setitem__(id, event)
+            self.dirty[id] = 'put'
+
+    def __delitem__(self, id):
+        with self.lock:
+            super().__delitem__(id)
+            self.dirty[id] = 'del'
+
+    def update(self, other):
+        for id, event in other.items():
+            self[id] = event
+
+    def load(self):
+        if os.path.isfile(self.filename):
+            with open(self.filename, "r", encoding='utf8') as injson:
+                dict.update(self, json.load(injson))
+
+        if not os.path.isfile(self.journal_filename):
+            return
+
+        num_records = 0
+        with open(self.journal_filename, "r", encoding='utf8') as journal:
+            for line in journal:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Probably a write cut off by a crash. Everything
+                    # before it is fine.
+                    logging.warning("Ignoring bad record in {}".format(
+                      self.journal_filename))
+                    continue
+
+                if record['op'] == 'put':
+                    dict.__setitem__(self, record['id'], record['event'])
+                elif record['op'] == 'del':
+                    dict.pop(self, record['id'], None)
+
+                num_records = num_records + 1
+
+        logging.debug("Replayed {} journal records".format(num_records))
+
+    def save(self):
+        """ Append a record for every event changed since the last 
+            save, then compact if the journal is too big.
+        """
+
+        with self.lock:
+            with open(self.journal_filename, "a", encoding='utf8') \
+              as journal:
+                for id, op in self.dirty.items():
+                    record = {'op': op, 'id': id}
+                    if op == 'put':
+                        record['event'] = dict.__getitem__(self, id)
+                    journal.write(json.dumps(record))
+                    journal.write("\n")
+
+                journal.flush()
+                os.fsync(journal.fileno())
+
+            logging.info("Wrote {} journal records".format(len(self.dirty)))
+            self.dirty = {}
+
+        if self.needs_compaction():
+            if self.background:
+                self.compactor = threading.Thread(target=self.compact)
+                self.compactor.start()
+            else:
+                self.compact()
+
+    def needs_compaction(self):
+        if self.compactor is not None and self.compactor.is_alive():
+            return False
+
+        journal_size = os.path.getsize(self.journal_filename)
+        snapshot_size = 0
+        if os.path.isfile(self.filename):
+            snapshot_size = os.path.getsize(self.filename)
+
+        return journal_size > self.compact_ratio * snapshot_size
+
+    def compact(self):
+        """ Fold the journal into a new snapshot. """
+
+        with self.lock:
+            snapshot = dict(self)
+            journal_offset = os.path.getsize(self.journal_filename)
+
+        tmp_file = "{}.tmp".format(self.filename)
+        with open(tmp_file, "w", encoding='utf8') as out:
+            json.dump(snapshot, out)
+            out.flush()
+            os.fsync(out.fileno())
+        os.replace(tmp_file, self.filename)
+
+        # Keep anything saved while we were busy
+        with self.lock:
+            with open(self.journal_filename, "r", encoding='utf8') \
+              as journal:
+                journal.seek(journal_offset)
+                tail = journal.read()
+
+            tmp_journal = "{}.tmp".format(self.journal_filename)
+            with open(tmp_journal, "w", encoding='utf8') as out:
+                out.write(tail)
+                out.flush()
+                os.fsync(out.fileno())
+            os.replace(tmp_journal, self.journal_filename)
+
+        logging.info("Compacted {} events into {}".format(
+          len(snapshot),
+          self.filename,
+          ))
+
+    def wait(self):
+        if self.compactor is not None:
+            self.compactor.join()
+            self.compactor = None
+
+    def close(self):
+        self.wait()
+
+# -------------------------
+class SqliteEventStore(EventStore, collections.abc.MutableMapping):
+    """ Events in an SQLite database, one row per event. The columns
+        we filter and sort on are pulled out of the event and indexed,
+        so prepare_event_lists does not have to decode every event 
+        just to throw most of them away. The full event is kept as 
+        JSON in the payload column.
+
+        Like the other stores, events we hand out are the stored 
+        objects, not copies: anything decoded is kept (along with the
+        payload it came from), and save() writes back the ones that 
+        were changed in place.
     """
 
-    global _current_backoff
+    SCHEMA = """
+      CREATE TABLE IF NOT EXISTS events (
+        id TEXT PRIMARY KEY,
+        end_utc TEXT,
+        virtual INTEGER NOT NULL DEFAULT 0,
+        too_far INTEGER NOT NULL DEFAULT 0,
+        filtered INTEGER NOT NULL DEFAULT 0,
+        published TEXT,
+        payload TEXT NOT NULL
+        );
+      CREATE INDEX IF NOT EXISTS events_end_utc ON events (end_utc);
+      CREATE INDEX IF NOT EXISTS events_flags 
+        ON events (virtual, too_far, filtered);
+      CREATE INDEX IF NOT EXISTS events_published ON events (published);
+      """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.is_new = not os.path.isfile(filename)
+        self.db = None
+        # id -> (event, payload it was decoded from or saved as)
+        self.decoded = {}
+
+    def load(self):
+        self.db = sqlite3.connect(self.filename)
+        self.db.executescript(self.SCHEMA)
+
+    def save(self):
+        for id, (event, payload) in self.decoded.items():
+            new_payload = json.dumps(event)
+            if new_payload != payload:
+                self.write(id, event, new_payload)
+
+        self.db.commit()
+
+    def close(self):
+        if self.db is not None:
+            self.db.commit()
+            self.db.close()
+            self.db = None
+            self.decoded = {}
+
+    def write(self, id, event, payload):
+        extrainfo = event.get('extrainfo', {})
+        # An upsert rather than INSERT OR REPLACE, so a changed event 
+        # keeps its rowid. rowid order is then the same as the order
+        # a dict would have, which the feeds use to break ties.
+        self.db.execute(
+          "INSERT INTO events "
+          "(id, end_utc, virtual, too_far, filtered, published, payload) "
+          "VALUES (?, ?, ?, ?, ?, ?, ?) "
+          "ON CONFLICT (id) DO UPDATE SET end_utc = excluded.end_utc, "
+          "virtual = excluded.virtual, too_far = excluded.too_far, "
+          "filtered = excluded.filtered, published = excluded.published, "
+          "payload = excluded.payload",
+          (
+            id,
+            event['end']['utc'],
+            bool(extrainfo.get('virtual')),
+            bool(extrainfo.get('too_far')),
+            bool(extrainfo.get('filtered_out')),
+            event.get('published'),
+            payload,
+          ))
+        self.decoded[id] = (event, payload)
+
+    def decode(self, id, payload):
+        """ The event for a row, decoding it only the first time. """
+        if id not in self.decoded:
+            self.decoded[id] = (json.loads(payload), payload)
+        return self.decoded[id][0]
+
+    def __contains__(self, id):
+        if id in self.decoded:
+            return True
+        return self.db.execute(
+          "SELECT 1 FROM events WHERE id = ?", (id,)).fetchone() \
+          is not None
+
+    def __getitem__(self, id):
+        if id in self.decoded:
+            return self.decoded[id][0]
+
+        row = self.db.execute(
+          "SELECT payload FROM events WHERE id = ?", (id,)).fetchone()
+        if row is None:
+            raise KeyError(id)
+        return self.decode(id, row[0])
+
+    def __setitem__(self, id, event):
+        self.write(id, event, json.dumps(event))
+
+    def __delitem__(self, id):
+        self.decoded.pop(id, None)
+        if self.db.execute(
+          "DELETE FROM events WHERE id = ?", (id,)).rowcount == 0:
+            raise KeyError(id)
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM events").fetchone()[0]
+
+    def __iter__(self):
+        # Read all the IDs first, so the caller can change the store
+        # while going through them
+        return iter([row[0] for row in self.db.execute(
+          "SELECT id FROM events ORDER BY rowid")])
+
+    def items(self):
+        for id, payload in self.db.execute(
+          "SELECT id, payload FROM events ORDER BY rowid").fetchall():
+            yield id, self.decode(id, payload)
+
+    def select_events(self, where, params, order_by="rowid"):
+        return [Event(id, self.decode(id, payload)) 
+          for id, payload in self.db.execute(
+            "SELECT id, payload FROM events WHERE {} ORDER BY {}".format(
+              where,
+              order_by,
+              ),
+            params).fetchall()]
+
+    def partition(self, too_old):
+        """ See partition_events. The feeds are sorted by published 
+            date, so get them in that order from the index. Ties are
+            in rowid order, which is where sort_json_events_by_pubdate
+            (a stable sort) leaves them for the other backends.
+        """
+
+        cutoff = datetime_to_utc_string(too_old)
+
+        ids_to_delete = [row[0] for row in self.db.execute(
+          "SELECT id FROM events WHERE end_utc < ?", (cutoff,))]
+
+        virtual_events = self.select_events(
+          "end_utc >= ? AND virtual = 1", (cutoff,))
+        filtered_events = self.select_events(
+          "end_utc >= ? AND virtual = 0 AND too_far = 0 AND filtered = 1",
+          (cutoff,), "published DESC, rowid")
+        non_filtered_events = self.select_events(
+          "end_utc >= ? AND virtual = 0 AND too_far = 0 AND filtered = 0",
+          (cutoff,), "published DESC, rowid")
+
+        return non_filtered_events, filtered_events, \
+          virtual_events, ids_to_delete
+
+    def delete_ids(self, ids):
+        for id in ids:
+            self.decoded.pop(id, None)
+        self.db.executemany(
+          "DELETE FROM events WHERE id = ?", [(id,) for id in ids])
 
-    if config['flags'].get('dump'):
-        htmldir = ensure_dumpdir(config, "html-pages")
-        jsondir = ensure_dumpdir(config, "json-from-html")
+# -------------------------
+class LazyEvent(collections.abc.Mapping):
+    """ A read-only event from a CompactEventStore. The small fields
+        in COMPACT_EAGER_KEYS are decoded when the store is loaded. 
+        The rest (descriptions, pulled_event, venue...) are only 
+        decompressed the first time someone asks for one of them, 
+        which is usually when a feed renders the event.
+    """
 
-    curr_page = 1
-    keep_going = True
-    last_json = json_so_far
-    new_json = None
-    while (curr_page <= page_limit) \
-      and keep_going:
-        
+    def __init__(self, eager, fd, offset, length):
+        self.eager = eager
+        self.fd = fd
+        self.offset = offset
+        self.length = length
+        self.heavy = None
+
+    def raw(self):
+        """ The compressed record, exactly as it is in the file. """
+        # pread does not move a shared file offset, so this is safe
+        # from threads (and forked processes).
+        return os.pread(self.fd, self.length, self.offset)
+
+    def decode(self):
+        if self.heavy is None:
+            self.heavy = json.loads(zlib.decompress(self.raw()))
+        return self.heavy
+
+    def __getitem__(self, key):
+        if key in self.eager:
+            return self.eager[key]
+        return self.decode()[key]
+
+    def __iter__(self):
+        yield from self.eager
+        yield from self.decode()
+
+    def __len__(self):
+        return len(self.eager) + len(self.decode())
+
+    def to_dict(self):
+        event = dict(self.decode())
+        event.update(self.eager)
+        return event
 
-        if curr_page == 1:
-            payload = {}
-        else:
-            payload = {'page': curr_page}
+# -------------------------
+class CompactEventStore(EventStore):
+    """ Events in a compact binary file with lazy decoding. The layout
+        is:
+          - COMPACT_MAGIC
+          - one record per event: a 4 byte big-endian length, then 
+            the zlib-compressed JSON of everything except the eager 
+            fields
+          - the index: zlib-compressed JSON list of 
+            [id, offset, length, eager fields]
+          - footer: index offset, index length, COMPACT_MAGIC
+
+        Loading only reads the index, so prepare_event_lists can 
+        filter and sort on the eager fields without decompressing any
+        records. Saving copies the compressed bytes of unchanged 
+        events straight across, and renames the new file into place.
+    """
 
-        r = requests.get(target, params=payload)
+    def __init__(self, filename):
+        self.filename = filename
+        self.is_new = not os.path.isfile(filename)
+        self.events = {}
+        self.fds = []
 
-        try:
-            r.raise_for_status()
-            if curr_page != 1:
-                logging.info("Fetched page {}: {}".format(
-                  curr_page, 
-                  r.url,
-                  ))
-        except requests.exceptions.HTTPError as e:
+    def load(self):
+        if self.is_new:
+            return
 
-            # No, probably should not be all statuses. Just 429.
-            if r.status_code == 429:
-                logging.warn("Received {} from Eventbrite: {}.".format(
-                  r.status_code,
-                  e,
-                  ))
-                if _current_backoff > config['eventbrite']['backoff_limit']:
-                    logging.warn("Backoff value {} is over "
-                      "limit {}. Giving up.".format(
-                        _current_backoff,
-                        config['eventbrite']['backoff_limit'],
-                        ))
-                    return json_so_far
+        fd = os.open(self.filename, os.O_RDONLY)
+        self.fds.append(fd)
+
+        file_size = os.fstat(fd).st_size
+        index_offset, index_length, magic = COMPACT_FOOTER.unpack(
+          os.pread(fd, COMPACT_FOOTER.size, file_size - COMPACT_FOOTER.size))
+
+        if magic != COMPACT_MAGIC or \
+          os.pread(fd, len(COMPACT_MAGIC), 0) != COMPACT_MAGIC:
+            raise ValueError("{} is not a compact event file".format(
+              self.filename))
+
+        index = json.loads(zlib.decompress(
+          os.pread(fd, index_length, index_offset)))
+
+        for id, offset, length, eager in index:
+            self.events[id] = LazyEvent(eager, fd, offset, length)
+
+    def save(self):
+        tmp_file = "{}.tmp".format(self.filename)
+        index = []
+
+        with open(tmp_file, "wb") as out:
+            out.write(COMPACT_MAGIC)
+
+            for id, event in self.events.items():
+                eager = {key: event[key] for key in COMPACT_EAGER_KEYS 
+                  if key in event}
+
+                if type(event) is LazyEvent:
+                    record = event.raw()
                 else:
-                    logging.info("Sleeping for {} minutes. Zzzz".format(
-                      _current_backoff,
-                      ))
-                    time.sleep(60 * _current_backoff)
-                    logging.info("Waking up!")
-                    _current_backoff = _current_backoff * 2
-
-                    # Now try again to get the same page.
-                    continue
+                    heavy = {key: value for key, value in event.items()
+                      if key not in COMPACT_EAGER_KEYS}
+                    record = zlib.compress(
+                      json.dumps(heavy, separators=(',', ':')).encode(
+                        'utf8'))
 
+                out.write(struct.pack('>I', len(record)))
+                index.append([id, out.tell(), len(record), eager])
+                out.write(record)
 
-            logging.warn("Oy. Received status {}, error '{}' for"
-              "url {} on page {}.  Bailing".format(
-                r.status_code,
-                e,
-                r.url,
-                curr_page,
-                )) 
-            return json_so_far
+            index_offset = out.tell()
+            index_blob = zlib.compress(
+              json.dumps(index, separators=(',', ':')).encode('utf8'))
+            out.write(index_blob)
+            out.write(COMPACT_FOOTER.pack(
+              index_offset, len(index_blob), COMPACT_MAGIC))
 
-        page = BeautifulSoup(r.text, 'html.parser')
-        new_json = extract_events(page)
+            out.flush()
+            os.fsync(out.fileno())
 
-        if config['flags'].get('dump'):
-            filename = url_to_filename(r.url)
-            dump_file(r.text, htmldir, filename, "html")
-            dump_file(new_json, jsondir, filename, "json")
+        # Lazy events still point at the old file, which stays 
+        # readable through our open fd until close().
+        os.replace(tmp_file, self.filename)
 
+    def close(self):
+        for fd in self.fds:
+            os.close(fd)
+        self.fds = []
 
-        if new_json and new_json == last_json:
-            keep_going = False
-            logging.info("Found duplicate set of events."
-              "Assuming we are done. {}".format(
-                curr_page
-                ))
+    def __contains__(self, id):
+        return id in self.events
 
-        if new_json: 
-            last_json = new_json
-            json_so_far = json_so_far + new_json
+    def __getitem__(self, id):
+        return self.events[id]
 
+    def __setitem__(self, id, event):
+        self.events[id] = event
 
-        curr_page = curr_page + 1
+    def __delitem__(self, id):
+        del self.events[id]
 
-    logging.info("Traversed {} pages".format(curr_page - 1))
-    
-    return json_so_far
+    def __len__(self):
+        return len(self.events)
 
-# ----------------------------
-def download_events(config):
-    """ Download events. Produces a list of JSON elements.
-        Consumes the configuration dict.
-    """
+    def __iter__(self):
+        return iter(self.events)
 
-    all_events = json.loads('[]')
+    def keys(self):
+        return self.events.keys()
 
-    if config['flags'].get('dump'):
-        htmldir = ensure_dumpdir(config, "html-pages")
-        jsondir = ensure_dumpdir(config, "json-from-html")
+    def items(self):
+        return self.events.items()
 
-    for target in config['eventbrite']['target_urls']:
-        r = requests.get(target)
-        try:
-            r.raise_for_status()
-        except requests.exceptions.HTTPError as e:
-            logging.error("download_events: Received HTTP error: {} . "
-              "Skipping.".format(
-              e, 
+    def update(self, other):
+        for id, event in other.items():
+            self[id] = event
+
+# -------------------------
+def iter_json_object_items(infile, chunk_size=65536):
+    """ Read a JSON object (like the cache_file) from infile a chunk 
+        at a time, producing (key, value, start, end) for each member
+        as soon as it has been read. start and end are where the value
+        is in the file (in characters), so it can be read again later.
+        Only one value at a time is in memory, not the whole object.
+    """
+
+    decoder = json.JSONDecoder()
+    text = ""
+    base = 0   # where text starts in the file
+    pos = 0    # where we are in text
+    at_eof = False
+
+    def fill():
+        # Drop what we have parsed and read another chunk
+        nonlocal text, base, pos, at_eof
+        text = text[pos:]
+        base = base + pos
+        pos = 0
+        chunk = infile.read(chunk_size)
+        if not chunk:
+            at_eof = True
+        text = text + chunk
+
+    def peek():
+        # Skip whitespace and produce the next character ("" at EOF)
+        nonlocal pos
+        while True:
+            while pos < len(text) and text[pos] in " \t\r\n":
+                pos = pos + 1
+            if pos < len(text) or at_eof:
+                return text[pos:pos + 1]
+            fill()
+
+    def decode():
+        # A value that stops at the end of text might be cut off 
+        # (or be a number with more digits to come), so read more
+        # and try again.
+        nonlocal pos
+        while True:
+            try:
+                value, end = decoder.raw_decode(text, pos)
+                if end < len(text) or at_eof:
+                    start = base + pos
+                    pos = end
+                    return value, start, base + end
+            except ValueError:
+                if at_eof:
+                    raise
+            fill()
+
+    def expect(chars):
+        nonlocal pos
+        char = peek()
+        if char not in chars:
+            raise ValueError("Expected {} at position {} but got '{}'".format(
+              " or ".join(chars),
+              base + pos,
+              char,
               ))
-            continue
+        pos = pos + 1
+        return char
 
-        # Get the JSON I want
-        page = BeautifulSoup(r.text, 'html.parser')
+    if peek() == "":
+        return
 
-        logging.info("{}: Got initial data".format(target))
-        
+    expect(["{"])
 
-        # Update 2022-08-30: on 2022-07-27 Eventbrite changed 
-        # something, and this div disappeared from the interface.
+    if peek() == "}":
+        return
 
-        # Update 2024-04-27: On 2024-04-24 Eventbrite changed something 
-        # else around pagination. They now say there are 500 pages total.
-        # We never get a 404 when running out of events any more.
-        #
-        # Worse this does not get generated until some JS runs, I think.
+    while True:
+        peek()
+        key = decode()[0]
+        expect([":"])
+        peek()
+        value, start, end = decode()
 
-        # Update 2024-05-01: There is a 'window.__SERVER_DATA__' entry
-        # that contains both the pagination (if it exists) and the
-        # type of the page (discovery, organization, etc). If we can 
-        # get this information we can stop guessing.
+        yield key, value, start, end
+
+        if expect([",", "}"]) == "}":
+            return
+
+# -------------------------
+class LazyJsonEvent(LazyEvent):
+    """ A read-only event from a StreamingEventStore. The record is 
+        plain JSON (the whole event) instead of compressed JSON of the
+        heavy fields.
+    """
 
-        total_pages = 1
-        found_total_pages = False
+    def decode(self):
+        if self.heavy is None:
+            self.heavy = json.loads(self.raw().decode('utf8'))
+        return self.heavy
 
-        all_js = page.find_all('script', type="text/javascript",
-          recursive=True)
+    def __iter__(self):
+        return iter(self.decode())
 
-        logging.debug("How many JS? {}".format(len(all_js)))
+    def __len__(self):
+        return len(self.decode())
 
-        for script in all_js:
-            if script.string and 'window.__SERVER_DATA__' in script.string:
-                content = str(script.string)
-                raw_string = re.search(SERVER_DATA_REGEXP, content)
+    def to_dict(self):
+        return dict(self.decode())
 
-                data = json.loads(raw_string[1])
+# -------------------------
+class StreamingEventStore(CompactEventStore):
+    """ Uses the same JSON cache_file as JsonEventStore, but reads it 
+        with iter_json_object_items instead of json.load. Only the 
+        fields in COMPACT_EAGER_KEYS are kept for each event, along 
+        with where the event is in the file; the rest is read back 
+        when someone asks for it (usually when a feed renders the 
+        event). So memory goes with the events we actually use, not 
+        the size of the cache.
+
+        Saving writes unchanged events back out byte for byte, and 
+        renames the new file into place. Otherwise this works like 
+        CompactEventStore.
+    """
 
-                if 'app_name' in data:
-                    logging.debug("{}: app_name is {}".format(
-                      target,
-                      data['app_name'],
-                      ))
+    def load(self):
+        if self.is_new:
+            return
+
+        fd = os.open(self.filename, os.O_RDONLY)
+        self.fds.append(fd)
+
+        # latin-1 turns each byte into one character, so positions 
+        # in the text are positions in the file. json.dump escapes
+        # anything that is not ASCII, so nothing gets mangled.
+        with open(self.filename, "r", encoding='latin-1') as infile:
+            for id, event, start, end in iter_json_object_items(infile):
+                eager = {key: event[key] for key in COMPACT_EAGER_KEYS
+                  if key in event}
+                self.events[id] = LazyJsonEvent(eager, fd, start, 
+                  end - start)
+
+    def save(self):
+        tmp_file = "{}.tmp".format(self.filename)
+        index = []
+
+        with open(tmp_file, "wb") as out:
+            out.write(b"{")
+
+            for id, event in self.events.items():
+                if index:
+                    out.write(b",")
+                out.write("\n{}: ".format(json.dumps(id)).encode('utf8'))
+
+                if type(event) is LazyJsonEvent:
+                    record = event.raw()
                 else:
-                    logging.debug("{}: Uh oh! No app_name found!".format(
-                      target,
-                      ))
-                 
-                if 'page_count' in data:
-                    logging.debug("{}: Page count is {}".format(
-                      target,
-                      data['page_count'],
-                      ))
-                    total_pages = data['page_count']
-                    found_total_pages = True
-
-                break
-
-        if not found_total_pages: 
-            logging.debug("{}: did not find pagination."
-              " Assuming {}".format(
-                target,
-                total_pages,
-                ))
+                    record = json.dumps(event, default=dict).encode('utf8')
 
-        events = traverse_pages(
-          config,
-          target, 
-          [], 
-          min(total_pages, 
-          config['eventbrite']['max_pages_to_fetch'],
-          ))
-        logging.info("{}: Got {} items!".format(
-          target,
-          len(events))
-          )
+                eager = {key: event[key] for key in COMPACT_EAGER_KEYS 
+                  if key in event}
+                index.append([id, out.tell(), len(record), eager])
+                out.write(record)
 
-        all_events = all_events + events
+            out.write(b"\n}\n")
 
-    return all_events
+            out.flush()
+            os.fsync(out.fileno())
 
-# -----------------------------
-def incorporate_events(config, event_dict, new_events):
-    """ Incorporate new events into event_dict, if they are worthy.
+        # Events we already handed out still point at the old file, 
+        # which stays readable through our open fd until close().
+        os.replace(tmp_file, self.filename)
+        self.is_new = False
 
-        config: the config dict
-        event_dict: indexed by event ID
-        new_events: raw downloaded events
-    """
+        fd = os.open(self.filename, os.O_RDONLY)
+        self.fds.append(fd)
 
-    timezone = pytz.timezone(config['feeds']['timezone'])
-    now = get_time_now(config)
-    recent = now - datetime.timedelta(days=1)
+        for id, offset, length, eager in index:
+            self.events[id] = LazyJsonEvent(eager, fd, offset, length)
 
-    for event in new_events:
-        id = url_to_id(event['url'])
-        too_far = False
-        filtered = False
-        virtual = False
+# -------------------------
+def open_event_store(config):
+    """ Make and load the event store chosen by paths.cache_backend 
+        ('json', the default, 'journal', 'stream', 'sqlite' or 
+        'compact').
 
-        # Make an aware date 
-        end_date_raw = None
-        if 'endDate' in event:
-            end_date_raw = dateutil.parser.parse(event['endDate'])
-        elif 'end_date' in event:
-            end_date_raw = dateutil.parser.parse(event['end_date'])
+        The first time the sqlite or compact backends are used, any 
+        events in the old JSON cache_file are copied over.
+    """
+
+    backend = config['paths'].get('cache_backend', 'json')
+
+    if backend == 'json':
+        store = JsonEventStore(get_cache_filename(config, 'cache_file'))
+        store.load()
 
+    elif backend == 'journal':
+        # The snapshot is plain JSON, so switching from 'json' just 
+        # works.
+        store = JournalEventStore(
+          get_cache_filename(config, 'cache_file'),
+          config['paths'].get('journal_compact_ratio', 0.5),
+          config['paths'].get('journal_compact_background', True),
+          )
+        store.load()
 
-        if end_date_raw.tzinfo is None or \
-          end_date_raw.tzinfo.utcoffset(end_date_raw) is None:
+    elif backend == 'stream':
+        # Same file as 'json', so the two can be swapped freely
+        store = StreamingEventStore(get_cache_filename(config, 'cache_file'))
+        store.load()
 
-            end_date = timezone.localize(end_date_raw)
+    elif backend in ['sqlite', 'compact']:
+        if backend == 'sqlite':
+            store = SqliteEventStore(get_cache_filename(config, 'cache_db'))
         else:
-            end_date = end_date_raw
+            store = CompactEventStore(
+              get_cache_filename(config, 'cache_compact'))
+        store.load()
+
+        json_file = get_cache_filename(config, 'cache_file')
+        if store.is_new and os.path.isfile(json_file):
+            old_store = JsonEventStore(json_file)
+            old_store.load()
+            store.update(old_store)
+            store.save()
+            logging.info("Migrated {} events from {} to {}".format(
+              len(old_store),
+              json_file,
+              store.filename,
+              ))
 
-        if end_date < recent:
-            logging.debug("{}: ends {} and now is {}. Past?".format(
-              id,
-              end_date,
-              recent))
-            continue
+    else:
+        raise UnknownHandlerException(
+          "Unknown cache_backend '{}'".format(backend))
+
+    return store
+
+# =========================
+# DESCRIPTION STORE
+#
+# Recurring events tend to share the same (long) full description, 
+# so instead of keeping a copy in every cached event we keep each 
+# distinct description once, named by its hash. Events get a 
+# 'full_description_hash' instead of a 'full_description'.
+
+class DescriptionStore:
+    """ A folder of <sha1>.html files plus an index.json that counts 
+        how many cached events use each one. Files nobody uses are 
+        deleted on save(), after the event cache has been saved, so 
+        a crash leaves (at worst) some unused files around.
+    """
 
-        if event_is_virtual(event):
-            virtual = True 
-        elif not event_in_boundary(config, event):
-            too_far = True
+    def __init__(self, folder):
+        self.folder = folder
+        self.index_filename = os.path.join(folder, "index.json")
+        self.refcounts = {}
+        self.is_new = True
+        self.texts = {}
+        self.rendered = {}
 
+    def load(self):
+        os.makedirs(self.folder, exist_ok=True)
+        if os.path.isfile(self.index_filename):
+            with open(self.index_filename, "r", encoding='utf8') as infile:
+                self.refcounts = json.load(infile)
+            self.is_new = False
 
-        if id in event_dict:
-            # TODO: Compare against (short) description. 
-            # If they are different then need to update. 
-            logging.debug("Event {} already in event_dict".format(id))
-            continue
+    def filename(self, hash):
+        return os.path.join(self.folder, "{}.html".format(hash))
 
-        if not too_far:
-            api_event = get_event_from_api(config, id)
+    def add(self, text):
+        """ Store text (if we do not have it already) and count one 
+            more user of it. Produces its hash.
+        """
 
-            if api_event is None:
-                # Something went bad. Better bail 
-                logging.warn("API call failed. Stopping fetch.")
-                continue
+        hash = hashlib.sha1(text.encode('utf8')).hexdigest()
 
-            # TODO: Check against blacklist and mark as filtered
-            if api_event["organizer_id"] in \
-              config['eventbrite']['filtered_organizers']:
-                filtered = True
-        else:
-            # Make a dummy event cheaply
-            api_event = {}
+        if not os.path.isfile(self.filename(hash)):
+            tmp_file = "{}.tmp".format(self.filename(hash))
+            with open(tmp_file, "w", encoding='utf8') as out:
+                out.write(text)
+            os.replace(tmp_file, self.filename(hash))
 
+        self.refcounts[hash] = self.refcounts.get(hash, 0) + 1
+        self.texts[hash] = text
 
-            api_event['end'] = {
-              'utc': end_date.strftime("%FT%H:%M:%SZ")
-              }
+        return hash
 
-        api_event['extrainfo'] = { 
-          'too_far' : too_far,
-          'filtered_out' : filtered,
-          'virtual' : virtual,
-          'added' : now.strftime("%FT%T"),
-          }
+    def release(self, hash):
+        """ One fewer event uses this description. """
 
-        api_event['pulled_event'] = event
+        if hash in self.refcounts:
+            self.refcounts[hash] = self.refcounts[hash] - 1
 
-        event_dict[id] = api_event
+    def get(self, hash):
+        if hash not in self.texts:
+            with open(self.filename(hash), "r", encoding='utf8') as infile:
+                self.texts[hash] = infile.read()
+
+        return self.texts[hash]
+
+    def render(self, hash, fun):
+        """ Produce fun(description), working it out only once per 
+            distinct description.
+        """
+
+        key = (fun, hash)
+        if key not in self.rendered:
+            self.rendered[key] = fun(self.get(hash))
+
+        return self.rendered[key]
+
+    def save(self):
+        for hash in [hash for hash, count in self.refcounts.items()
+          if count <= 0]:
+            del self.refcounts[hash]
+            self.texts.pop(hash, None)
+            if os.path.isfile(self.filename(hash)):
+                os.remove(self.filename(hash))
+
+        tmp_file = "{}.tmp".format(self.index_filename)
+        with open(tmp_file, "w", encoding='utf8') as out:
+            json.dump(self.refcounts, out)
+        os.replace(tmp_file, self.index_filename)
+
+# -------------------------
+def open_description_store(config):
+    """ Make and load the DescriptionStore in paths.description_store
+        and make it the one for this run. If that is not set, full 
+        descriptions stay in the events and this produces None.
+    """
+
+    global _description_store
+
+    _description_store = None
+
+    if config['paths'].get('description_store'):
+        _description_store = DescriptionStore(
+          get_cache_filename(config, 'description_store'))
+        _description_store.load()
+
+    return _description_store
+
+# -------------------------
+def store_description(event):
+    """ Move the full description of event (a dict) into the 
+        description store, if we have one.
+    """
+
+    if _description_store and 'full_description' in event:
+        event['full_description_hash'] = _description_store.add(
+          event.pop('full_description') or "")
+
+# -------------------------
+def release_description(event):
+    """ event is leaving the cache. Let go of its description. """
+
+    if _description_store and 'full_description_hash' in event:
+        _description_store.release(event['full_description_hash'])
+
+# -------------------------
+def store_all_descriptions(event_dict):
+    """ Move the full descriptions of every event in event_dict into 
+        the description store. This is for caches made before there 
+        was a description store.
+    """
+
+    for id in list(event_dict.keys()):
+        event = event_dict[id]
+        if 'full_description' in event:
+            event = dict(event)
+            store_description(event)
+            event_dict[id] = event
+
+# -------------------------
+def get_full_description(item, fun):
+    """ Produce fun(full description of item), whether the description
+        is in the item or in the description store. 
+    """
+
+    if 'full_description_hash' in item and _description_store:
+        return _description_store.render(item['full_description_hash'], fun)
+
+    return fun(item.get('full_description') or "")
+
+# -------------------------
+def rss_description(text):
+    """ A full description, cleaned up and escaped for RSS. """
+    return markupsafe.escape(remove_invalid_xml_chars(text))
 
 # -------------------------
 def prepare_event_lists(config, event_dict):
@@ -1485,36 +4651,19 @@ def prepare_event_lists(config, event_dict):
             because they are in the past
 
         Filtered and non-filtered events are sorted (how?)
-    """
 
-    ids_to_delete = []
-    non_filtered_events = []
-    filtered_events = []
-    virtual_events = []
+        event_dict may be a plain dict or an EventStore. Stores can
+        answer this with queries instead of looking at every event.
+    """
 
     too_old = get_time_now(config) - datetime.timedelta(days=1)
-    timezone = pytz.timezone(config['feeds']['timezone'])
-
-
-    for id, event in event_dict.items():
-        end_date = dateutil.parser.parse(event['end']['utc'])
-
-        if end_date < too_old:
-            ids_to_delete.append(id)
-            logging.debug("Dropped event {} with end time {}".format(
-              id,
-              event['end']['utc']
-              ))
-        elif 'virtual' in event['extrainfo'] and \
-          event['extrainfo']['virtual']:
-            virtual_events.append(event)
-        elif event['extrainfo']['too_far']:
-            continue
-        elif event['extrainfo']['filtered_out']:
-            filtered_events.append(event)
-        else:
-            non_filtered_events.append(event)
 
+    if isinstance(event_dict, EventStore):
+        non_filtered_events, filtered_events, virtual_events, \
+          ids_to_delete = event_dict.partition(too_old)
+    else:
+        non_filtered_events, filtered_events, virtual_events, \
+          ids_to_delete = partition_events(event_dict, too_old)
         
     non_filtered_events = sort_json_events_by_pubdate(
       non_filtered_events,
@@ -1534,6 +4683,14 @@ def clean_event_dict(event_dict, ids_to_delete):
     """ Removes every event with an id ids_to_delete from event_dict.
     """
 
+    if _description_store:
+        for id in ids_to_delete:
+            release_description(event_dict[id])
+
+    if isinstance(event_dict, EventStore):
+        event_dict.delete_ids(ids_to_delete)
+        return
+
     for id in ids_to_delete:
         del event_dict[id]
 
@@ -1548,8 +4705,9 @@ def ensure_dumpdir(config, subdir):
 
     fullpath = os.path.join(config['paths']['dump_path'], subdir)
 
+    # Crawl threads may race to make this, so exist_ok
     if not os.path.isdir(fullpath):
-        os.makedirs(fullpath)
+        os.makedirs(fullpath, exist_ok=True)
 
     return fullpath
 
@@ -1568,7 +4726,9 @@ def dump_file(target, dumpdir, filename, file_ext):
 
     with open(dump_path, "w", encoding='utf8') as out:
         if file_ext == "json":
-            json.dump( target, out, indent=2, separators=(',', ': '))
+            # default is for LazyEvents from the compact store
+            json.dump( target, out, indent=2, separators=(',', ': '),
+              default=dict)
         elif file_ext == "txt":
             pprint.pprint(target, stream=out)
         elif file_ext == "html":
@@ -1576,6 +4736,25 @@ def dump_file(target, dumpdir, filename, file_ext):
         
 
 
+# ------------------------------
+def get_cache_filename(config, path_key):
+    """ Given a key in config['paths'] (eg 'cache_file') whose value 
+        has a name and an optional relative_to_cache_path, produce 
+        the local path.
+    """
+
+    path_info = config['paths'][path_key]
+
+    cache_filename = path_info['name']
+
+    if path_info.get('relative_to_cache_path'):
+        cache_filename = os.path.join(
+          config['paths']['cache_path'],
+          path_info['name'],
+          )
+
+    return cache_filename
+
 # ------------------------------
 def get_feed_filename(conf, feed_key, suffix):
     """ Given the config, a feed key (eg 'base_feed') defined in 
@@ -1632,35 +4811,28 @@ def write_transformation(transforms):
     if config['flags'].get('dump'):
         ddir = config['paths']['dump_path']
 
-    event_dict = {} 
-
-    event_cache_file = config['paths']['cache_file']['name']
+    event_dict = open_event_store(config)
+    description_store = open_description_store(config)
 
-    if config['paths']['cache_file']['relative_to_cache_path']:
-        event_cache_file = os.path.join(
-          config['paths']['cache_path'],
-          config['paths']['cache_file']['name'],
-          )
-
-
-    if os.path.isfile(event_cache_file):
-        with open(event_cache_file, "r", encoding='utf8') as injson:
-            event_dict = json.load(injson)
+    if description_store and description_store.is_new:
+        store_all_descriptions(event_dict)
 
-        if config['flags'].get('dump'):
-            dump_file(event_dict, ddir, "00-orig-events", 
-              "json")
+    if config['flags'].get('dump'):
+        dump_file(dict(event_dict.items()), ddir, "00-orig-events", 
+          "json")
 
     logging.debug("Just before calling API")
 
     if not config['flags'].get('skip_api'): # Yay double negative
-        raw_events = download_events(config)
+        known_ids = set(event_dict.keys()) | negative_cache_ids(config)
+        raw_events = download_events(config, known_ids)
 
         incorporate_events(config, event_dict, raw_events)
 
         if config['flags'].get('dump'):
             dump_file(raw_events, ddir, "05-raw-events", "json")
-            dump_file(event_dict, ddir, "10-merged-events", "json")
+            dump_file(dict(event_dict.items()), ddir, "10-merged-events", 
+              "json")
 
         logging.info("Made {} API calls".format(_num_api_calls))
 
@@ -1675,78 +4847,48 @@ def write_transformation(transforms):
         dump_file(virtual_json, ddir, "25-virtual-events", "json")
         dump_file(old_ids, ddir, "30-old-ids", "txt")
 
-    # Incorporate into dump_file?
-    with open(event_cache_file, "w", encoding='utf8') as out_events:
-        json.dump(event_dict, out_events, indent=2, separators=(',', ': '))
+    event_dict.save()
+
+    if description_store:
+        description_store.save()
+
+    fragment_cache = open_fragment_cache(config)
+
+    feeds = [
+      ('base_feed', nice_json),
+      ('filtered_feed', filtered_json),
+      ('virtual_feed', virtual_json),
+      ]
 
     destpairs = []
 
     for transform_type in transforms:
         if transform_type == "rss":
-            destpairs.append({
-              'generated_file': generate_rss(
-                config,
-                nice_json,
-                'base_feed',
-                ),
-              'dest': get_feed_filename(config, 'base_feed', 'rss')
-              })
-            destpairs.append({
-              'generated_file': generate_rss(
-                config,
-                filtered_json,
-                'filtered_feed',
-                ),
-              'dest': get_feed_filename(config, 'filtered_feed', 'rss')
-              })
-            destpairs.append({
-              'generated_file': generate_rss(
-                config,
-                virtual_json,
-                'virtual_feed',
-                ),
-              'dest': get_feed_filename(config, 'virtual_feed', 'rss')
-              })
-
+            suffix = "rss"
         elif transform_type == "ical":
-            destpairs.append({
-              'generated_file': generate_ical(
-                config,
-                nice_json,
-                'base_feed',
-                ),
-              'dest': get_feed_filename(config, 'base_feed', 'ics')
-              })
-            destpairs.append({
-              'generated_file': generate_ical(
-                config,
-                filtered_json,
-                'filtered_feed',
-                ),
-              'dest': get_feed_filename(config, 'filtered_feed', 'ics')
-              })
-            destpairs.append({
-              'generated_file': generate_ical(
-                config,
-                virtual_json,
-                'virtual_feed',
-                ),
-              'dest': get_feed_filename(config, 'virtual_feed', 'ics')
-              })
-
+            suffix = "ics"
         else:
             raise NameError("Incorrect type '%s' listed" %
               (transform_type,))
 
-    for outpair in destpairs:
-        # Insert Windows newlines for dumb email clients
-        outfile = open(
-          outpair['dest'], 
-          "w", 
-          newline='\r\n', 
-          encoding='utf8',
-          )
-        outfile.write(outpair['generated_file'])
+        for feed_key, feed_events in feeds:
+            destpairs.append({
+              'kind': transform_type,
+              'events': feed_events,
+              'feed_key': feed_key,
+              'dest': get_feed_filename(config, feed_key, suffix),
+              })
+
+    # Lazy events from the compact and stream stores read from the 
+    # store's files, so only close the store once the feeds are 
+    # written (or have failed)
+    try:
+        render_feeds(config, destpairs)
+    finally:
+        event_dict.close()
+
+    if fragment_cache:
+        fragment_cache.save()
 
     logging.info("Completed run")
 
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+
+# Compare the BeautifulSoup and fast script-scanning extractors on the
+# listing pages saved with --dump-dir.
+#
+# Run: python scripts/bench_extract.py /tmp/dump
+# (after pip install -e . so eventbrite_helpers can be imported)
+
+import argparse, os
+import time
+
+from bs4 import BeautifulSoup
+from eventbrite_helpers import helpers as h
+
+
+# ------------------------------
+def time_it(fun, text, repeats):
+    """ Run fun(text) repeats times. Produces the best time in seconds
+        and the result of the last run.
+    """
+
+    best = None
+    result = None
+
+    for i in range(repeats):
+        start = time.perf_counter()
+        result = fun(text)
+        elapsed = time.perf_counter() - start
+
+        if best is None or elapsed < best:
+            best = elapsed
+
+    return best, result
+
+
+# ------------------------------
+def soup_extract(text):
+    page = BeautifulSoup(text, 'html.parser')
+    return h.extract_events(page), h.find_server_data(page)
+
+
+# ------------------------------
+def fast_extract(text):
+    blocks = h.find_script_blocks(text)
+    return h.extract_events_fast(text, blocks), \
+      h.find_server_data_fast(text, blocks)
+
+
+# ------------------------------
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark event extraction on dumped pages",
+        )
+    parser.add_argument('dump_dir',
+        help='folder given to --dump-dir (we read html-pages/ in it)',
+        )
+    parser.add_argument('-r', '--repeats',
+        help='how many times to parse each page',
+        type=int,
+        default=5,
+        )
+    args = parser.parse_args()
+
+    htmldir = os.path.join(args.dump_dir, "html-pages")
+    pages = sorted(f for f in os.listdir(htmldir) if f.endswith(".html"))
+
+    total_soup = 0.0
+    total_fast = 0.0
+    mismatches = 0
+
+    print("{:>8} {:>10} {:>10} {:>8}  {}".format(
+      "KB", "soup ms", "fast ms", "speedup", "page"))
+
+    for filename in pages:
+        with open(os.path.join(htmldir, filename), encoding='utf8') as f:
+            text = f.read()
+
+        soup_time, soup_result = time_it(soup_extract, text, args.repeats)
+        fast_time, fast_result = time_it(fast_extract, text, args.repeats)
+
+        total_soup = total_soup + soup_time
+        total_fast = total_fast + fast_time
+
+        same = soup_result == fast_result
+        if not same:
+            mismatches = mismatches + 1
+
+        print("{:>8.0f} {:>10.1f} {:>10.1f} {:>7.1f}x  {}{}".format(
+          len(text) / 1024,
+          soup_time * 1000,
+          fast_time * 1000,
+          soup_time / fast_time if fast_time else 0,
+          filename,
+          "" if same else "  MISMATCH",
+          ))
+
+    if pages:
+        print("\nTotal: soup {:.1f} ms, fast {:.1f} ms ({:.1f}x) over "
+          "{} pages, {} mismatches".format(
+            total_soup * 1000,
+            total_fast * 1000,
+            total_soup / total_fast if total_fast else 0,
+            len(pages),
+            mismatches,
+            ))
+    else:
+        print("No pages found in {}".format(htmldir))
+
+
+if __name__ == '__main__':
+    main()
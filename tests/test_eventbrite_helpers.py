@@ -12,6 +12,7 @@ import pytest
 import os
 import json
 import pprint
+import collections.abc
 
 
 # ==== CONSTANTS
@@ -402,6 +403,25 @@ def test_durations(start, end, duration):
     assert h.get_duration_in_minutes(end, start) == duration
 
 
+@pytest.mark.parametrize(
+  "date_string",
+  [t["arg"] for t in DATE_TESTS["tests"]] + [
+    "2021-03-23T21:00:00Z",
+    "2021-03-23T21:00:00-04:00",
+    "2021-03-23T21:00:00.000Z",
+    "2021-03-23",
+    ] + [d[0] for d in DURATION_DICT],
+  )
+def test_parse_datetime_matches_dateutil(date_string):
+    parsed = h.parse_datetime(date_string)
+    assert parsed == dateutil.parser.parse(date_string)
+    assert parsed.utcoffset() == \
+      dateutil.parser.parse(date_string).utcoffset()
+
+    # Already parsed? Leave it be.
+    assert h.parse_datetime(parsed) is parsed
+
+
 # ---- LOGLEVEL TESTS ----------------------
 
 #def test_loglevel_dir(
@@ -475,6 +495,1275 @@ def test_url_to_id_noid():
       h.url_to_id("https://www.eventbrite.ca/e/sunday-afternoon-service-ti")
 
 
+# ----- TEST CRAWLING
+
+def test_host_semaphore_per_host():
+    crawl_config = {'eventbrite': {'max_requests_per_host': 2}}
+    a = h.host_semaphore(crawl_config, "https://www.eventbrite.ca/o/foo-1")
+    b = h.host_semaphore(crawl_config, "https://www.eventbrite.ca/d/bar/")
+    c = h.host_semaphore(crawl_config, "https://www.eventbrite.com/o/foo-1")
+    assert a is b
+    assert a is not c
+
+
+@pytest.mark.parametrize("workers", [1, 3])
+def test_download_events_keeps_target_order(workers, monkeypatch):
+    targets = ["https://www.eventbrite.ca/o/{}".format(i) 
+      for i in range(5)]
+    crawl_config = {
+      'eventbrite': {
+        'target_urls': targets,
+        'crawl_workers': workers,
+        },
+      'flags': {},
+      }
+
+    crawl_config['eventbrite']['max_pages_to_fetch'] = 1
+
+    def fake_crawl_target(config, target, known_ids=None):
+        return [target['url'] + "-a", target['url'] + "-b"]
+    monkeypatch.setattr(h, 'crawl_target', fake_crawl_target)
+
+    assert h.download_events(crawl_config) == \
+      [t + suffix for t in targets for suffix in ("-a", "-b")]
+
+
+def test_http_session_is_shared(monkeypatch):
+    monkeypatch.setattr(h, '_http_session', None)
+    http_config = {'http': {'pool_maxsize': 3}}
+    session = h.get_http_session(http_config)
+    assert h.get_http_session(http_config) is session
+    assert session.get_adapter("https://www.eventbrite.ca/")._pool_maxsize \
+      == 3
+
+
+def test_replay_serves_captures(tmp_path, monkeypatch):
+    import requests
+    api_url = "https://www.eventbriteapi.com/v3/events/7/?token=SECRET"
+    page_url = "https://www.eventbrite.ca/o/someone-42?page=2"
+
+    # Record, the way call_api does with --dump-dir
+    dump_config = {'flags': {'dump': True}, 
+      'paths': {'dump_path': str(tmp_path)}}
+    prepared = requests.Request('GET', api_url).prepare()
+    class Recorded:
+        request = prepared
+        def json(self):
+            return {'id': "7"}
+    h.record_api_response(dump_config, Recorded())
+    assert not any("SECRET" in f 
+      for f in os.listdir(tmp_path / "api-responses"))
+
+    os.makedirs(tmp_path / "html-pages")
+    with open(tmp_path / "html-pages" / "{}.html".format(
+      h.url_to_filename(page_url)), "w") as out:
+        out.write("<html>page 2</html>")
+
+    monkeypatch.setattr(h, '_http_session', None)
+    replay_config = {'flags': {'replay': True}, 
+      'paths': {'replay_path': str(tmp_path)}}
+
+    assert h.http_request(replay_config, 'GET', api_url).json() == \
+      {'id': "7"}
+    r = h.http_request(replay_config, 'GET', 
+      "https://www.eventbrite.ca/o/someone-42", params={'page': 2})
+    assert r.text == "<html>page 2</html>"
+
+    r = h.http_request(replay_config, 'GET', page_url + "0")
+    assert r.status_code == 404
+    with pytest.raises(requests.exceptions.HTTPError):
+        r.raise_for_status()
+
+
+
+def test_page_validators_roundtrip(tmp_path):
+    cache_config = {'paths': {
+      'cache_path': str(tmp_path),
+      'http_cache': {'name': 'validators', 'relative_to_cache_path': True},
+      }}
+    url = "https://www.eventbrite.ca/d/foo/?page=2"
+    events = [{'url': "https://www.eventbrite.ca/e/1"}]
+
+    assert h.load_page_validators(cache_config, url) is None
+    assert h.conditional_headers(None) == {}
+
+    h.save_page_validators(cache_config, url, 
+      FakeResponse(200, 
+        {'ETag': '"abc"', 'Last-Modified': 'Wed, 19 Apr 2017'}),
+      events)
+    cached = h.load_page_validators(cache_config, url)
+
+    assert cached['events'] == events
+    assert h.conditional_headers(cached) == {
+      'If-None-Match': '"abc"',
+      'If-Modified-Since': 'Wed, 19 Apr 2017',
+      }
+
+
+# ----- TEST API ENRICHMENT
+
+def make_api_config(**extra):
+    api_config = {
+      'eventbrite': {
+        'api_token': 'TOKEN',
+        'get_full_descriptions': True,
+        'filtered_organizers': [],
+        },
+      'flags': {},
+      }
+    api_config['eventbrite'].update(extra)
+    return api_config
+
+
+def fake_call_api(config, api_url, api_params):
+    """ Pretend to be the API. Event 13 does not exist, and event 14
+        never answers.
+    """
+    import requests
+    id = api_url.split("/events/")[1].split("/")[0]
+    if id == "13":
+        raise requests.exceptions.HTTPError("404 for {}".format(id))
+    if id == "14":
+        raise requests.exceptions.ConnectTimeout("timeout for {}".format(id))
+    if api_url.endswith("/description"):
+        return {'description': "desc {}".format(id)}
+    return {'id': id, 'organizer_id': "org"}
+
+
+@pytest.mark.parametrize("workers", [1, 4])
+def test_get_events_from_api(workers, monkeypatch):
+    monkeypatch.setattr(h, 'call_api', fake_call_api)
+    api_events = h.get_events_from_api(
+      make_api_config(api_workers=workers), ["1", "13", "2", "14"])
+
+    assert api_events["13"] is None
+    assert api_events["14"] is None
+    assert api_events["1"] == {'id': "1", 'organizer_id': "org", 
+      'full_description': "desc 1"}
+    assert api_events["2"]['full_description'] == "desc 2"
+
+
+@pytest.mark.parametrize("echo_urls", [True, False])
+def test_get_events_from_batch_api(echo_urls, monkeypatch):
+    def no_single_calls(config, api_url, api_params):
+        raise AssertionError("The budget did not count on this call")
+    monkeypatch.setattr(h, 'call_api', no_single_calls)
+    monkeypatch.setattr(h, '_api_failures', {})
+    monkeypatch.setattr(h, '_api_deferred', set())
+
+    def fake_call_batch_api(config, batch_requests):
+        responses = []
+        for req in batch_requests:
+            id = req['relative_url'].split("/")[1]
+            if id == "2":
+                # Pretend the batch hiccupped on this one
+                response = {'code': 500, 'body': None}
+            elif id == "4":
+                response = {'code': 404, 'body': None}
+            elif "description" in req['relative_url']:
+                response = {'code': 200, 
+                  'body': json.dumps({'description': "batch " + id})}
+            else:
+                response = {'code': 200, 
+                  'body': json.dumps({'id': id, 'organizer_id': "org"})}
+            if echo_urls:
+                response['relative_url'] = "/" + req['relative_url']
+            responses.append(response)
+
+        # The order means nothing if the responses say what they are
+        if echo_urls:
+            responses.reverse()
+        return responses
+
+    monkeypatch.setattr(h, 'call_batch_api', fake_call_batch_api)
+
+    api_events = h.get_events_from_api(
+      make_api_config(api_batch_size=4), ["1", "2", "3", "4"])
+
+    assert api_events["1"]['full_description'] == "batch 1"
+    assert api_events["3"]['full_description'] == "batch 3"
+    assert api_events["2"] is None and api_events["4"] is None
+
+    # 2 is tried again next run, and 4 is really gone
+    assert h.pop_api_deferred() == {"2"}
+    assert h.pop_api_failures() == {"4": 404}
+
+
+def test_batch_size_fits_the_batch_limit(monkeypatch):
+    batch_sizes = []
+
+    def fake_get_event_batch(config, ids):
+        batch_sizes.append(len(ids))
+        return {id: None for id in ids}
+    monkeypatch.setattr(h, 'get_event_batch', fake_get_event_batch)
+
+    ids = [str(id) for id in range(25)]
+    h.get_events_from_api(make_api_config(api_batch_size=50), ids)
+    assert batch_sizes == [10, 10, 5]
+
+    batch_sizes.clear()
+    h.get_events_from_api(make_api_config(api_batch_size=50, 
+      get_full_descriptions=False), ids)
+    assert batch_sizes == [20, 5]
+
+
+# ----- TEST RATE LIMITING
+
+class FakeResponse:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.url = "https://www.eventbrite.ca/fake"
+
+
+def test_retry_after_seconds():
+    assert h.retry_after_seconds(FakeResponse(429)) is None
+    assert h.retry_after_seconds(
+      FakeResponse(429, {'Retry-After': '120'})) == 120
+    assert h.retry_after_seconds(
+      FakeResponse(429, {'Retry-After': 'Wed, 19 Apr 2017 15:01:56 GMT'})) \
+      == 0
+    assert h.retry_after_seconds(
+      FakeResponse(429, {'Retry-After': 'soon'})) is None
+
+
+def test_token_bucket_burst():
+    bucket = h.TokenBucket(1000, 3, 1)
+    for i in range(3):
+        bucket.acquire()
+    assert bucket.tokens < 1
+
+
+def test_token_bucket_backoff():
+    bucket = h.TokenBucket(1000, 3, 1)
+    assert [bucket.note_limited() for i in range(3)] == [1, 2, 4]
+
+    # One success does not undo everyone else's 429s
+    bucket.note_success()
+    assert bucket.backoff == 4
+    for i in range(5):
+        bucket.note_success()
+    assert bucket.backoff == 1
+
+
+def test_rate_bucket_unlimited_without_rate_limits(monkeypatch):
+    import time
+    monkeypatch.setattr(h, '_rate_buckets', {})
+    bucket = h.get_rate_bucket({'eventbrite': {}}, 'scrape', 
+      "https://www.eventbrite.ca/o/foo-1")
+    assert bucket.rate is None
+
+    start = time.monotonic()
+    for i in range(50):
+        bucket.acquire()
+    assert time.monotonic() - start < 1
+
+
+def test_rate_limited_request_retries(monkeypatch):
+    responses = [
+      FakeResponse(429, {'Retry-After': '0'}),
+      FakeResponse(429, {'Retry-After': '0'}),
+      FakeResponse(200),
+      ]
+    monkeypatch.setattr(h, 'http_request', 
+      lambda config, method, url, **kwargs: responses.pop(0))
+    monkeypatch.setattr(h, '_rate_buckets', {})
+
+    rate_config = {'eventbrite': {
+      'backoff_initial': 1, 
+      'backoff_limit': 4,
+      'rate_limits': {'api': {'per_second': 1000, 'burst': 5}},
+      }}
+    r = h.rate_limited_request(rate_config, 'api', 'GET', 
+      "https://www.eventbriteapi.com/v3/events/1")
+    assert r.status_code == 200
+    assert responses == []
+
+
+def test_rate_limited_request_gives_up(monkeypatch):
+    monkeypatch.setattr(h, 'http_request', 
+      lambda config, method, url, **kwargs: 
+        FakeResponse(429, {'Retry-After': '0'}))
+    monkeypatch.setattr(h, '_rate_buckets', {})
+
+    rate_config = {'eventbrite': {
+      'backoff_initial': 1, 
+      'backoff_limit': 4,
+      'rate_limits': {'api': {'per_second': 1000, 'burst': 5}},
+      }}
+    r = h.rate_limited_request(rate_config, 'api', 'GET', 
+      "https://www.eventbriteapi.com/v3/events/1")
+    assert r.status_code == 429
+
+
+# ----- TEST EXTRACTION
+
+LD_JSON_PAGE = """<html><head>
+<script type="text/javascript">window.__SERVER_DATA__ = {"app_name": "discovery", "page_count": 3};</script>
+<script type='application/ld+json'>
+{"@type": "ItemList", "itemListElement": [
+  {"@type": "ListItem", "item": {"@type": "Event", "url": "https://www.eventbrite.ca/e/1"}},
+  {"@type": "ListItem", "item": {"@type": "Place"}}]}
+</script>
+<SCRIPT TYPE="application/ld+json">[{"@type": "Event", "url": "https://www.eventbrite.ca/e/2"}]</SCRIPT>
+</head><body><p>Hello</p></body></html>
+"""
+
+NEXT_DATA_PAGE = """<html><body>
+<script id="__NEXT_DATA__" type="application/json">{"props": {"pageProps": {"upcomingEvents": [{"url": "https://www.eventbrite.ca/e/3"}]}}}</script>
+</body></html>
+"""
+
+@pytest.mark.parametrize("page_text", [LD_JSON_PAGE, NEXT_DATA_PAGE, 
+  "<html><body>No events</body></html>"])
+def test_fast_extract_matches_soup(page_text):
+    from bs4 import BeautifulSoup
+    page = BeautifulSoup(page_text, 'html.parser')
+
+    assert h.extract_events_fast(page_text) == h.extract_events(page)
+    assert h.find_server_data_fast(page_text) == h.find_server_data(page)
+
+
+def test_parse_listing_page():
+    events, server_data = h.parse_listing_page(
+      {'eventbrite': {}}, LD_JSON_PAGE)
+    assert [e['url'] for e in events] == [
+      "https://www.eventbrite.ca/e/1",
+      "https://www.eventbrite.ca/e/2",
+      ]
+    assert server_data['page_count'] == 3
+
+
+def test_parse_listing_page_scans_once(monkeypatch):
+    scans = []
+    find_script_blocks = h.find_script_blocks
+
+    def counting_find_script_blocks(text):
+        scans.append(text)
+        return find_script_blocks(text)
+    monkeypatch.setattr(h, 'find_script_blocks', counting_find_script_blocks)
+
+    events, server_data = h.parse_listing_page(
+      {'eventbrite': {}}, LD_JSON_PAGE)
+    assert len(events) == 2 and server_data['page_count'] == 3
+    assert len(scans) == 1
+
+
+def test_fast_extract_gives_up_on_strange_html():
+    # An unterminated script: let BeautifulSoup deal with it
+    assert h.extract_events_fast(
+      '<script type="application/ld+json">[]') is None
+
+
+class FakePage:
+    """ A listing page response for traverse_pages """
+    def __init__(self, text):
+        self.status_code = 200
+        self.headers = {}
+        self.text = text
+        self.url = "https://www.eventbrite.ca/fake"
+
+    def raise_for_status(self):
+        pass
+
+
+def make_listing_page(ids, page_count=None):
+    server_data = ""
+    if page_count:
+        server_data = ('<script type="text/javascript">window.__SERVER_DATA__'
+          ' = {{"page_count": {}}};</script>'.format(page_count))
+    events = json.dumps([{"@type": "Event", 
+      "url": "https://www.eventbrite.ca/e/{}".format(id)} for id in ids])
+    return '{}<script type="application/ld+json">{}</script>'.format(
+      server_data, events)
+
+
+@pytest.mark.parametrize("page_count, expected_requests", [
+  (None, 1),
+  (1, 1),
+  (3, 3),
+  (50, 5),
+  ])
+def test_traverse_pages_request_count(page_count, expected_requests, 
+  monkeypatch):
+    requested = []
+
+    def fake_request(config, kind, method, url, params=None, **kwargs):
+        page = params.get('page', 1)
+        requested.append(page)
+        return FakePage(make_listing_page([page], page_count))
+
+    monkeypatch.setattr(h, 'rate_limited_request', fake_request)
+
+    crawl_config = {'eventbrite': {}, 'paths': {}, 'flags': {}}
+    events = h.traverse_pages(crawl_config, 
+      "https://www.eventbrite.ca/o/foo-1", [], 5)
+
+    assert requested == list(range(1, expected_requests + 1))
+    assert len(events) == expected_requests
+
+
+@pytest.mark.parametrize("stop_after_known, expected_requests", [
+  (0, 5),
+  (1, 3),
+  (2, 4),
+  ])
+def test_traverse_pages_incremental(stop_after_known, expected_requests, 
+  monkeypatch):
+    # Pages 1 and 2 have new events; everything after is known
+    page_ids = {1: ["1", "2"], 2: ["3"], 3: ["1"], 4: ["2"], 5: ["2", "1"]}
+    requested = []
+
+    def fake_request(config, kind, method, url, params=None, **kwargs):
+        page = params.get('page', 1)
+        requested.append(page)
+        return FakePage(make_listing_page(page_ids[page], 5))
+
+    monkeypatch.setattr(h, 'rate_limited_request', fake_request)
+
+    crawl_config = {'eventbrite': {}, 'paths': {}, 'flags': {}}
+    h.traverse_pages(crawl_config, "https://www.eventbrite.ca/o/foo-1", 
+      [], 10, {"1"}, stop_after_known)
+
+    assert len(requested) == expected_requests
+
+
+def test_traverse_pages_survives_timeouts(monkeypatch):
+    import requests
+
+    def fake_request(config, kind, method, url, params=None, **kwargs):
+        page = params.get('page', 1)
+        if page == 3:
+            raise requests.exceptions.ReadTimeout("too slow")
+        return FakePage(make_listing_page([page], 5))
+
+    monkeypatch.setattr(h, 'rate_limited_request', fake_request)
+
+    crawl_config = {'eventbrite': {}, 'paths': {}, 'flags': {}}
+    events = h.traverse_pages(crawl_config, 
+      "https://www.eventbrite.ca/o/foo-1", [], 5)
+    assert [e['url'] for e in events] == [
+      "https://www.eventbrite.ca/e/1", "https://www.eventbrite.ca/e/2"]
+
+
+def test_traverse_pages_captures_for_replay(tmp_path, monkeypatch):
+    target = "https://www.eventbrite.ca/o/foo-1"
+    crawl_config = {'eventbrite': {}, 'flags': {'dump': True}, 
+      'paths': {'dump_path': str(tmp_path), 'cache_path': str(tmp_path),
+        'http_cache': {'name': 'validators', 'relative_to_cache_path': True}}}
+
+    # Last run saw these pages, so they could come back as 304s
+    for page in [1, 2]:
+        url = target if page == 1 else "{}?page={}".format(target, page)
+        h.save_page_validators(crawl_config, url, 
+          FakeResponse(200, {'ETag': '"abc"'}), [])
+
+    sent_headers = []
+    def fake_request(config, kind, method, url, params=None, headers=None,
+      **kwargs):
+        sent_headers.append(headers)
+        # FakePage says it came from somewhere else, like a redirect
+        return FakePage(make_listing_page([params.get('page', 1)], 2))
+    monkeypatch.setattr(h, 'rate_limited_request', fake_request)
+
+    events = h.traverse_pages(crawl_config, target, [], 5)
+    assert sent_headers == [{}, {}]
+
+    monkeypatch.undo()
+    monkeypatch.setattr(h, '_http_session', None)
+    replay_config = {'eventbrite': {}, 'flags': {'replay': True}, 
+      'paths': {'replay_path': str(tmp_path)}}
+    assert h.traverse_pages(replay_config, target, [], 5) == events
+
+
+def test_get_targets():
+    target_config = {'eventbrite': {
+      'max_pages_to_fetch': 10,
+      'target_urls': [
+        "https://www.eventbrite.ca/o/foo-1",
+        {'url': "https://www.eventbrite.ca/d/bar/", 
+         'stop_after_known_pages': 3},
+        ],
+      }}
+    assert h.get_targets(target_config) == [
+      {'url': "https://www.eventbrite.ca/o/foo-1",
+       'max_pages_to_fetch': 10, 'stop_after_known_pages': 0},
+      {'url': "https://www.eventbrite.ca/d/bar/",
+       'max_pages_to_fetch': 10, 'stop_after_known_pages': 3},
+      ]
+
+
+def make_candidate(id, start, virtual=False, organizer=None):
+    event = {'url': "https://www.eventbrite.ca/e/{}".format(id),
+      'startDate': start}
+    if organizer:
+        event['organizer'] = {
+          'url': "https://www.eventbrite.ca/o/someone-{}".format(organizer)}
+    return (id, event, None, False, virtual)
+
+
+def test_plan_enrichment_priority():
+    plan_config = make_api_config(
+      api_hourly_limit=1000, 
+      api_budget_per_run=6,
+      filtered_organizers=["666"],
+      )
+    plan_config['feeds'] = {'timezone': "America/Toronto"}
+    budget = {'calls': [], 'queue': {}}
+
+    candidates = [
+      make_candidate("1", "2017-05-01T10:00:00-04:00"),
+      make_candidate("2", "2017-04-20T10:00:00-04:00", virtual=True),
+      make_candidate("3", "2017-04-21T10:00:00-04:00", organizer="666"),
+      make_candidate("4", "2017-04-22T10:00:00"),
+      make_candidate("5", "not a date"),
+      ]
+
+    to_fetch, deferred = h.plan_enrichment(plan_config, budget, candidates)
+
+    # Two calls per event, six calls to spend
+    assert [c[0] for c in to_fetch] == ["4", "1", "5"]
+    assert [c[0] for c in deferred] == ["3", "2"]
+
+
+def test_plan_enrichment_hourly_limit():
+    plan_config = make_api_config(api_hourly_limit=10)
+    plan_config['feeds'] = {'timezone': "America/Toronto"}
+    budget = {'calls': [0] * 7, 'queue': {}}
+    candidates = [make_candidate(str(i), "2017-05-01") for i in range(3)]
+
+    to_fetch, deferred = h.plan_enrichment(plan_config, budget, candidates)
+    assert len(to_fetch) == 1
+    assert len(deferred) == 2
+
+
+
+def test_incorporate_events_queues_deferred(monkeypatch):
+    def fake_get_events(config, ids):
+        h.note_api_deferred("2")
+        return {id: None if id == "2" else {'id': id, 'organizer_id': "org"}
+          for id in ids}
+    monkeypatch.setattr(h, 'get_events_from_api', fake_get_events)
+    monkeypatch.setattr(h, 'event_in_boundary', lambda config, event: True)
+    monkeypatch.setattr(h, 'load_api_budget', 
+      lambda config: {'calls': [], 'queue': {}})
+    saved = {}
+    monkeypatch.setattr(h, 'save_api_budget', 
+      lambda config, budget: saved.update(budget))
+
+    scraped = [{'@type': "Event", 
+      'url': "https://www.eventbrite.ca/e/{}".format(id),
+      'endDate': "2099-05-01T10:00:00-04:00"} for id in ["1", "2"]]
+
+    api_config = make_api_config()
+    api_config['feeds'] = {'timezone': "America/Toronto"}
+    api_config['paths'] = {}
+    event_dict = {}
+    h.incorporate_events(api_config, event_dict, scraped)
+
+    assert list(event_dict.keys()) == ["1"]
+    assert list(saved['queue'].keys()) == ["2"]
+
+
+def test_incorporate_events_refreshes_changed(monkeypatch):
+    fetched = []
+    def fake_get_events(config, ids):
+        fetched.extend(ids)
+        return {id: {'id': id, 'organizer_id': "org", 'name': "new"} 
+          for id in ids}
+    monkeypatch.setattr(h, 'get_events_from_api', fake_get_events)
+    monkeypatch.setattr(h, 'event_in_boundary', lambda config, event: True)
+    monkeypatch.setattr(h, 'load_api_budget', 
+      lambda config: {'calls': [], 'queue': {}})
+    monkeypatch.setattr(h, 'save_api_budget', lambda config, budget: None)
+
+    def scraped(id, name):
+        return {'@type': "Event", 
+          'url': "https://www.eventbrite.ca/e/{}".format(id),
+          'name': name, 'endDate': "2099-05-01T10:00:00-04:00"}
+
+    def cached(event, fingerprints):
+        return {'id': h.url_to_id(event['url']), 'name': "old",
+          'extrainfo': {'too_far': False, 'filtered_out': False,
+            'virtual': False, 'added': "2017-04-01T00:00:00",
+            'fingerprints': fingerprints}}
+
+    same, changed, legacy = scraped("1", "Same"), \
+      scraped("2", "Edited"), scraped("3", "Legacy")
+    event_dict = {
+      "1": cached(same, {'ld': h.event_fingerprint(same)}),
+      "2": cached(changed, 
+        {'ld': h.event_fingerprint(scraped("2", "Original"))}),
+      "3": cached(legacy, {}),
+      }
+
+    api_config = make_api_config()
+    api_config['feeds'] = {'timezone': "America/Toronto"}
+    api_config['paths'] = {}
+    h.incorporate_events(api_config, event_dict, [same, changed, legacy])
+
+    assert fetched == ["2"]
+    assert event_dict["1"]['name'] == "old"
+    assert event_dict["2"]['name'] == "new"
+    assert event_dict["2"]['extrainfo']['added'] == "2017-04-01T00:00:00"
+    assert event_dict["2"]['extrainfo']['fingerprints'] == \
+      {'ld': h.event_fingerprint(changed)}
+    assert event_dict["3"]['name'] == "old"
+    assert event_dict["3"]['extrainfo']['fingerprints'] == \
+      {'ld': h.event_fingerprint(legacy)}
+
+
+
+def test_negative_cache_skips_failures(tmp_path, monkeypatch):
+    import requests, time
+    fetched = []
+    def fake_get_events(config, ids):
+        fetched.extend(ids)
+        for id in ids:
+            error = requests.exceptions.HTTPError("nope")
+            error.response = FakeResponse(404)
+            h.note_api_failure(id, error)
+        return {id: None for id in ids}
+    monkeypatch.setattr(h, 'get_events_from_api', fake_get_events)
+    monkeypatch.setattr(h, 'event_in_boundary', 
+      lambda config, event: event['url'].endswith("1"))
+
+    api_config = make_api_config()
+    api_config['feeds'] = {'timezone': "America/Toronto"}
+    api_config['paths'] = {
+      'cache_path': str(tmp_path),
+      'negative_cache_file': {'name': "negative.json", 
+        'relative_to_cache_path': True},
+      }
+    new_events = [{'url': "https://www.eventbrite.ca/e/{}".format(id),
+      'endDate': end} for id, end in [("1", "2099-05-01T10:00:00"), 
+        ("2", "2099-05-01T10:00:00"), ("3", "2001-05-01T10:00:00")]]
+
+    event_dict = {}
+    h.incorporate_events(api_config, event_dict, new_events)
+    assert fetched == ["1"]
+    assert event_dict["2"]['extrainfo']['too_far']
+
+    negative_cache = h.load_negative_cache(api_config)
+    assert {id: entry['reason'] for id, entry in negative_cache.items()} \
+      == {"1": 'not_found', "2": 'too_far', "3": 'past'}
+
+    # Nothing is looked at again until the entries run out
+    event_dict = {}
+    h.incorporate_events(api_config, event_dict, new_events)
+    assert fetched == ["1"]
+    assert event_dict == {}
+
+    # ...so incremental crawls can count them as known
+    assert h.negative_cache_ids(api_config) == {"1", "2", "3"}
+    negative_cache["3"]['until'] = time.time() - 1
+    h.save_negative_cache(api_config, negative_cache)
+    assert h.negative_cache_ids(api_config) == {"1", "2"}
+
+    # Failures in a row back off
+    h.remember_negative(api_config, negative_cache, "1", 'not_found')
+    assert negative_cache["1"]['failures'] == 2
+    assert negative_cache["1"]['until'] - time.time() > 47 * 3600
+
+
+
+def test_series_enrichment(monkeypatch):
+    fetched = []
+    def fake_get_events(config, ids):
+        fetched.extend(ids)
+        return {id: {'id': id, 'organizer_id': "42", 
+          'url': "https://www.eventbrite.ca/e/{}".format(id),
+          'start': {'timezone': "America/Toronto", 
+            'local': "2030-05-01T18:00:00", 'utc': "2030-05-01T22:00:00Z"},
+          'end': {'timezone': "America/Toronto", 
+            'local': "2030-05-01T20:00:00", 'utc': "2030-05-02T00:00:00Z"},
+          'created': "2017-01-01T00:00:00Z", 
+          'changed': "2017-02-01T00:00:00Z",
+          'published': "2017-01-02T00:00:00Z",
+          'ticket_availability': {'is_sold_out': True, 
+            'minimum_ticket_price': {'major_value': "10.00"},
+            'maximum_ticket_price': {'major_value': "10.00"}},
+          'full_description': "<p>Weekly yoga</p>"} for id in ids}
+    monkeypatch.setattr(h, 'get_events_from_api', fake_get_events)
+    monkeypatch.setattr(h, 'event_in_boundary', lambda config, event: True)
+
+    def scraped(id, day, name="Yoga"):
+        return {'@type': "Event", 'name': name,
+          'url': "https://www.eventbrite.ca/e/{}".format(id),
+          'organizer': {'url': "https://www.eventbrite.ca/o/yoga-42"},
+          'location': {'name': "The Hall"},
+          'startDate': "2030-05-{:02d}T18:00:00-04:00".format(day),
+          'endDate': "2030-05-{:02d}T20:00:00-04:00".format(day)}
+
+    api_config = make_api_config(series_enrichment=True)
+    api_config['feeds'] = {'timezone': "America/Toronto"}
+    api_config['paths'] = {}
+    event_dict = {}
+    h.incorporate_events(api_config, event_dict, 
+      [scraped("1", 1), scraped("2", 8), scraped("3", 15), 
+       scraped("4", 2, name="Pottery")])
+
+    assert fetched == ["1", "4"]
+    assert sorted(event_dict.keys()) == ["1", "2", "3", "4"]
+    assert event_dict["3"]['id'] == "3"
+    assert event_dict["3"]['start']['local'] == "2030-05-15T18:00:00"
+    assert event_dict["3"]['end']['utc'] == "2030-05-16T00:00:00Z"
+    assert event_dict["3"]['full_description'] == "<p>Weekly yoga</p>"
+    # Only the prices are shared, and the dates are its own
+    assert event_dict["3"]['ticket_availability'] == {
+      'minimum_ticket_price': {'major_value': "10.00"},
+      'maximum_ticket_price': {'major_value': "10.00"}}
+    assert event_dict["1"]['ticket_availability']['is_sold_out']
+    for key in ['created', 'changed', 'published']:
+        assert event_dict["3"][key] != event_dict["1"][key]
+        assert h.parse_datetime(event_dict["3"][key]) > \
+          h.parse_datetime(event_dict["1"][key])
+    assert event_dict["3"]['extrainfo']['series_of'] == "1"
+    assert 'series_of' not in event_dict["1"]['extrainfo']
+    assert event_dict["1"]['start']['local'] == "2030-05-01T18:00:00"
+
+
+def test_scraped_instance_times():
+    timezone = pytz.timezone("America/Toronto")
+    start, end = h.scraped_instance_times({'start_date': "2030-05-01",
+      'start_time': "18:00", 'end_date': "2030-05-01", 'end_time': "20:00",
+      'timezone': "America/Vancouver"}, timezone)
+    assert h.datetime_to_utc_string(start) == "2030-05-02T01:00:00Z"
+    assert h.scraped_instance_times({'@type': "Event", 
+      'startDate': "2030-05-01", 'endDate': "2030-05-01"}, timezone) is None
+
+
+# ----- TEST EVENT STORES
+
+def make_cached_event(id, end_utc, published="2017-04-01T00:00:00Z",
+  virtual=False, too_far=False, filtered=False):
+    return {
+      'id': id,
+      'end': {'utc': end_utc},
+      'published': published,
+      'full_description': "<p>Event {}</p>".format(id),
+      'extrainfo': {
+        'virtual': virtual,
+        'too_far': too_far,
+        'filtered_out': filtered,
+        },
+      }
+
+
+CACHED_EVENTS = {
+  "1": make_cached_event("1", "2017-04-25T00:00:00Z", 
+    published="2017-04-02T00:00:00Z"),
+  "2": make_cached_event("2", "2017-04-25T00:00:00Z", 
+    published="2017-04-03T00:00:00Z"),
+  "3": make_cached_event("3", "2017-04-10T00:00:00Z"),
+  "4": make_cached_event("4", "2017-04-25T00:00:00Z", virtual=True),
+  "5": make_cached_event("5", "2017-04-25T00:00:00Z", too_far=True),
+  "6": make_cached_event("6", "2017-04-25T00:00:00Z", filtered=True),
+  }
+
+
+def make_store_config(tmp_path, backend):
+    return {'paths': {
+      'cache_path': str(tmp_path),
+      'cache_backend': backend,
+      'cache_file': {'name': 'events.json', 'relative_to_cache_path': True},
+      'cache_db': {'name': 'events.sqlite', 'relative_to_cache_path': True},
+      'cache_compact': {'name': 'events.ebc', 'relative_to_cache_path': True},
+      }}
+
+
+STORE_BACKENDS = ['json', 'journal', 'stream', 'sqlite', 'compact']
+
+@pytest.mark.parametrize("backend", STORE_BACKENDS)
+def test_event_store_roundtrip(backend, tmp_path):
+    store_config = make_store_config(tmp_path, backend)
+
+    store = h.open_event_store(store_config)
+    for id, event in CACHED_EVENTS.items():
+        store[id] = event
+    del store["6"]
+    store.save()
+    store.close()
+
+    store = h.open_event_store(store_config)
+    assert len(store) == 5
+    assert "6" not in store
+    assert "1" in store
+    assert store["2"] == CACHED_EVENTS["2"]
+    assert sorted(store.keys()) == ["1", "2", "3", "4", "5"]
+    store.close()
+
+
+@pytest.mark.parametrize("backend", STORE_BACKENDS)
+def test_event_store_partition(backend, tmp_path):
+    store = h.open_event_store(make_store_config(tmp_path, backend))
+    for id, event in CACHED_EVENTS.items():
+        store[id] = event
+
+    too_old = dateutil.parser.parse("2017-04-18T15:01:56Z")
+    nice, filtered, virtual, old_ids = store.partition(too_old)
+
+    assert sorted(e['id'] for e in nice) == ["1", "2"]
+    assert [e['id'] for e in filtered] == ["6"]
+    assert [e['id'] for e in virtual] == ["4"]
+    assert old_ids == ["3"]
+
+    # Ties on published date, a second virtual event, and changed 
+    # events (which keep their place): every backend makes the same
+    # feeds
+    for id in ["9", "8"]:
+        store[id] = make_cached_event(id, "2017-04-25T00:00:00Z", 
+          published="2017-04-02T00:00:00Z")
+    store["7"] = make_cached_event("7", "2017-04-25T00:00:00Z", virtual=True)
+    store["1"] = CACHED_EVENTS["1"]
+    store["4"] = CACHED_EVENTS["4"]
+
+    nice, filtered, virtual, old_ids = store.partition(too_old)
+    assert [e['id'] for e in h.sort_json_events_by_pubdate(nice)] == \
+      ["2", "1", "9", "8"]
+    assert [e['id'] for e in virtual] == ["4", "7"]
+
+    h.clean_event_dict(store, old_ids)
+    assert "3" not in store
+    store.close()
+
+
+def test_sqlite_store_acts_like_a_dict(tmp_path):
+    store_config = make_store_config(tmp_path, 'sqlite')
+    store = h.open_event_store(store_config)
+    store.update(CACHED_EVENTS)
+    store.save()
+    store.close()
+
+    store = h.open_event_store(store_config)
+    assert isinstance(store, collections.abc.MutableMapping)
+    assert store.get("7") is None
+    assert store.get("1")['id'] == "1"
+    with pytest.raises(KeyError):
+        del store["7"]
+
+    # Changes made in place are kept
+    store["1"]['extrainfo']['added'] = "2017-04-19T00:00:00"
+    assert store["1"]['extrainfo']['added'] == "2017-04-19T00:00:00"
+
+    too_old = dateutil.parser.parse("2017-04-18T15:01:56Z")
+    nice, filtered, virtual, old_ids = store.partition(too_old)
+    assert [e['id'] for e in nice] == ["2", "1"]
+    assert nice[1].raw is store["1"]
+    store.save()
+    store.close()
+
+    store = h.open_event_store(store_config)
+    assert store["1"]['extrainfo']['added'] == "2017-04-19T00:00:00"
+    assert store["2"] == CACHED_EVENTS["2"]
+    store.close()
+
+    with pytest.raises(TypeError):
+        h.EventStore()
+
+
+@pytest.mark.parametrize("backend", ['sqlite', 'compact'])
+def test_store_migrates_json(backend, tmp_path):
+    with open(os.path.join(str(tmp_path), 'events.json'), 'w') as f:
+        json.dump(CACHED_EVENTS, f)
+
+    store = h.open_event_store(make_store_config(tmp_path, backend))
+    assert len(store) == len(CACHED_EVENTS)
+    assert store["4"] == CACHED_EVENTS["4"]
+    store.close()
+
+
+def test_journal_store_appends_and_compacts(tmp_path):
+    snapshot_file = os.path.join(str(tmp_path), 'events.json')
+
+    store = h.JournalEventStore(snapshot_file, compact_ratio=1000)
+    store.update(CACHED_EVENTS)
+    store.save()
+    store.close()
+
+    store = h.JournalEventStore(snapshot_file, compact_ratio=1000)
+    store.load()
+    store["1"] = make_cached_event("1", "2017-05-01T00:00:00Z")
+    del store["2"]
+    store.save()
+    store.close()
+
+    # The first save had no snapshot to compare against, so it 
+    # compacted. After that, only the changes get written.
+    with open(snapshot_file + ".journal") as f:
+        assert len(f.readlines()) == 2
+
+    # A crash in the middle of a write
+    with open(snapshot_file + ".journal", "a") as f:
+        f.write('{"op": "put", "id": "9", "ev')
+
+    store = h.JournalEventStore(snapshot_file, compact_ratio=0)
+    store.load()
+    assert store["1"]['end']['utc'] == "2017-05-01T00:00:00Z"
+    assert "2" not in store
+    assert "9" not in store
+
+    store.save()
+    store.wait()
+    assert store.compactor is None
+    store.close()
+
+    # Compacted: everything is in the snapshot
+    assert os.path.getsize(snapshot_file + ".journal") == 0
+    with open(snapshot_file) as f:
+        assert json.load(f) == dict(store)
+
+
+def test_journal_store_changes_wait_for_compactor(tmp_path):
+    import threading
+
+    snapshot_file = os.path.join(str(tmp_path), 'events.json')
+    store = h.JournalEventStore(snapshot_file)
+    store.update(CACHED_EVENTS)
+
+    # Pretend the compactor is copying the events
+    store.lock.acquire()
+    writer = threading.Thread(target=store.__setitem__, 
+      args=("1", make_cached_event("1", "2017-05-01T00:00:00Z")))
+    writer.start()
+    writer.join(0.2)
+    assert writer.is_alive()
+    assert store["1"] == CACHED_EVENTS["1"]
+    assert store.dirty == {}
+
+    store.lock.release()
+    writer.join()
+    assert store.dirty == {"1": 'put'}
+
+
+def test_compact_store_is_lazy(tmp_path):
+    store_config = make_store_config(tmp_path, 'compact')
+
+    store = h.open_event_store(store_config)
+    store.update(CACHED_EVENTS)
+    store.save()
+    store.close()
+
+    store = h.open_event_store(store_config)
+    too_old = dateutil.parser.parse("2017-04-18T15:01:56Z")
+    nice, filtered, virtual, old_ids = store.partition(too_old)
+
+    # Picking events did not decode any descriptions
+    assert all(event.heavy is None for event in store.events.values())
+
+    assert nice[0]['full_description'] == "<p>Event {}</p>".format(
+      nice[0]['id'])
+    assert nice[0].raw.heavy is not None
+    assert store["3"].to_dict() == CACHED_EVENTS["3"]
+
+    # Unchanged events are copied without decoding
+    store["7"] = make_cached_event("7", "2017-04-25T00:00:00Z")
+    store.save()
+    store.close()
+
+    store = h.open_event_store(store_config)
+    assert dict(store["7"]) == make_cached_event("7", "2017-04-25T00:00:00Z")
+    assert dict(store["5"]) == CACHED_EVENTS["5"]
+    store.close()
+
+
+
+
+def make_transformation_config(tmp_path, backend):
+    transformation_config = make_store_config(tmp_path, backend)
+    transformation_config['paths']['publish_path'] = str(tmp_path)
+    transformation_config['flags'] = {'skip_api': True}
+    transformation_config['eventbrite'] = {'get_full_descriptions': True}
+    transformation_config['feeds'] = dict(FEED_CONFIG['feeds'])
+    for feed_key in ['base_feed', 'filtered_feed', 'virtual_feed']:
+        transformation_config['feeds'][feed_key] = {'name': feed_key, 
+          'title': "t", 'description': "d", 
+          'relative_to_publish_path': True}
+    return transformation_config
+
+
+@pytest.mark.parametrize("backend", ['compact', 'stream'])
+def test_write_transformation_from_lazy_store(backend, tmp_path, 
+  monkeypatch):
+    transformation_config = make_transformation_config(tmp_path, backend)
+    monkeypatch.setattr(h, 'load_config', lambda: transformation_config)
+    monkeypatch.setattr(h, '_fragment_cache', None)
+    monkeypatch.setattr(h, '_description_store', None)
+
+    store = h.open_event_store(transformation_config)
+    for id in ["1", "2"]:
+        event = dict(make_feed_item(id), 
+          **make_cached_event(id, "2099-01-01T00:00:00Z", virtual=True))
+        event['end']['local'] = "2098-12-31T19:00:00"
+        store[id] = event
+    store.save()
+    store.close()
+
+    # The names are only read from the store's file when the feeds
+    # are rendered
+    h.write_transformation(["rss", "ical"])
+
+    for suffix in ["rss", "ics"]:
+        with open(tmp_path / "virtual_feed.{}".format(suffix), 
+          encoding='utf8') as infile:
+            feed = infile.read()
+        assert "Event 1" in feed and "Event 2" in feed
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 65536])
+def test_iter_json_object_items(chunk_size):
+    import io
+    text = '{"1": {"a": [1, 2]} , "22":12345,\n"3": "x\\"}"}'
+    items = list(h.iter_json_object_items(io.StringIO(text), chunk_size))
+
+    assert [(key, value) for key, value, start, end in items] == [
+      ("1", {'a': [1, 2]}), ("22", 12345), ("3", 'x"}')]
+    for key, value, start, end in items:
+        assert json.loads(text[start:end]) == value
+
+    assert list(h.iter_json_object_items(io.StringIO("{ }"))) == []
+    with pytest.raises(ValueError):
+        list(h.iter_json_object_items(io.StringIO('{"1": 2'), chunk_size))
+
+
+def test_streaming_store_is_lazy(tmp_path):
+    store_config = make_store_config(tmp_path, 'json')
+    store = h.open_event_store(store_config)
+    for id, end_utc in [("1", "2099-01-01T00:00:00Z"), 
+      ("2", "2017-01-01T00:00:00Z")]:
+        store[id] = make_cached_event(id, end_utc)
+        store[id]['pulled_event'] = {'name': "Caf\u00e9 {}".format(id)}
+    store.save()
+
+    store_config['paths']['cache_backend'] = 'stream'
+    store = h.open_event_store(store_config)
+    assert all(event.heavy is None for event in store.events.values())
+
+    store["3"] = make_cached_event("3", "2099-01-01T00:00:00Z")
+    h.clean_event_dict(store, ["2"])
+    store.save()
+    store.close()
+
+    # Still plain JSON that the json backend can read
+    store_config['paths']['cache_backend'] = 'json'
+    store = h.open_event_store(store_config)
+    assert sorted(store.keys()) == ["1", "3"]
+    assert store["1"]['pulled_event']['name'] == "Caf\u00e9 1"
+
+
+
+def test_event_model():
+    raw = make_cached_event("7", "2017-04-25T00:00:00Z", virtual=True)
+    raw['start'] = {'utc': "2017-04-24T22:00:00Z"}
+    raw['venue'] = {'latitude': "43.45", 'longitude': "-80.49"}
+    event = h.Event("7", raw)
+
+    assert event.end == dateutil.parser.parse("2017-04-25T00:00:00Z")
+    assert event.start == dateutil.parser.parse("2017-04-24T22:00:00Z")
+    assert (event.virtual, event.too_far, event.filtered) == \
+      (True, False, False)
+    assert (event.latitude, event.longitude) == (43.45, -80.49)
+
+    # Acts like the raw event, without growing a __dict__
+    assert event['full_description'] == "<p>Event 7</p>"
+    assert event == raw
+    assert json.loads(json.dumps(event, default=dict)) == raw
+    assert not hasattr(event, '__dict__')
+
+
+# ----- TEST DESCRIPTION STORE
+
+def test_description_store_shares_and_collects(tmp_path, monkeypatch):
+    # Put the module's store back afterwards
+    monkeypatch.setattr(h, '_description_store', None)
+    store_config = make_store_config(tmp_path, 'json')
+    store_config['paths']['description_store'] = {
+      'name': "descriptions", 'relative_to_cache_path': True}
+    store = h.open_description_store(store_config)
+    assert store.is_new
+
+    event_dict = {}
+    for id, desc in [("1", "<p>Weekly</p>"), ("2", "<p>Weekly</p>"),
+      ("3", "<p>Once & done</p>")]:
+        event = make_cached_event(id, "2099-05-01T00:00:00Z")
+        event['full_description'] = desc
+        h.store_description(event)
+        event_dict[id] = event
+
+    assert 'full_description' not in event_dict["1"]
+    assert event_dict["1"]['full_description_hash'] == \
+      event_dict["2"]['full_description_hash']
+    assert len(os.listdir(store.folder)) == 2
+
+    assert h.get_full_description(event_dict["3"], h.rss_description) \
+      == "&lt;p&gt;Once &amp; done&lt;/p&gt;"
+    assert h.get_full_description({'full_description': "<p>x</p>"},
+      h.get_ical_block) == "<p>x</p>"
+
+    h.clean_event_dict(event_dict, ["1", "3"])
+    store.save()
+
+    assert sorted(os.listdir(store.folder)) == sorted([
+      "index.json", 
+      "{}.html".format(event_dict["2"]['full_description_hash'])])
+
+    store = h.open_description_store(store_config)
+    assert not store.is_new
+    assert store.get(event_dict["2"]['full_description_hash']) \
+      == "<p>Weekly</p>"
+
+
+
+# ----- TEST TEMPLATES
+
+def test_templates_are_built_once(tmp_path, monkeypatch):
+    monkeypatch.setattr(h, '_template_envs', {})
+    template_config = {'paths': {'cache_path': str(tmp_path),
+      'template_cache': {'name': "jinja", 'relative_to_cache_path': True}}}
+
+    rss = h.get_template(template_config, 'rss')
+    assert h.get_template(template_config, 'rss') is rss
+    assert h.get_template(template_config, 'ical') is not rss
+    assert rss.environment.autoescape
+    assert len(os.listdir(tmp_path / "jinja")) == 4
+
+    # A new process finds the compiled templates on disk
+    monkeypatch.setattr(h, '_template_envs', {})
+    h.get_template(template_config, 'rss')
+    assert len(os.listdir(tmp_path / "jinja")) == 4
+
+
+
+def make_feed_item(id, changed="2017-04-01T00:00:00Z"):
+    return {'id': id, 'name': {'text': "Event {}".format(id)}, 
+      'is_free': True, 'url': "https://www.eventbrite.ca/e/{}".format(id),
+      'start': {'local': "2017-04-01T10:00:00"}, 
+      'end': {'local': "2017-04-01T11:00:00"},
+      'created': "2017-03-01T00:00:00Z", 'changed': changed,
+      'extrainfo': {'virtual': True}, 
+      'full_description': "<p>Event {}</p>".format(id)}
+
+
+FEED_CONFIG = {
+  'feeds': {'timezone': "America/Toronto", 'website': "https://x.org",
+    'webmaster': "w", 'webmaster_name': "n", 'currency_symbol': "$",
+    'base_feed': {'name': "b", 'title': "t", 'description': "d"}},
+  'eventbrite': {'get_full_descriptions': True},
+  'paths': {},
+  }
+
+
+@pytest.mark.parametrize("generate", [h.generate_rss, h.generate_ical])
+def test_fragment_cache(generate, tmp_path, monkeypatch):
+    monkeypatch.setattr(h, '_fragment_cache', None)
+    fragment_config = dict(FEED_CONFIG, paths={'cache_path': str(tmp_path),
+      'fragment_cache': {'name': "fragments.json", 
+        'relative_to_cache_path': True}})
+
+    items = [make_feed_item("1"), make_feed_item("2")]
+    cache = h.open_fragment_cache(fragment_config)
+    uncached = generate(fragment_config, items, 'base_feed')
+    cache.save()
+
+    # Fake the fragments, to see which ones get used
+    with open(cache.filename) as infile:
+        fragments = json.load(infile)
+    assert len(fragments) == 2
+    fragments = {key: fragment.replace("Event", "Cached") 
+      for key, fragment in fragments.items()}
+    with open(cache.filename, "w") as out:
+        json.dump(fragments, out)
+
+    cache = h.open_fragment_cache(fragment_config)
+    items = [make_feed_item("1"), make_feed_item("2", "2017-04-02T00:00:00Z")]
+    output = generate(fragment_config, items, 'base_feed')
+    assert "Cached 1" in output
+    assert "Event 2" in output and "Cached 2" not in output
+    cache.save()
+    with open(cache.filename) as infile:
+        assert len(json.load(infile)) == 2
+
+    monkeypatch.setattr(h, '_fragment_cache', None)
+    assert generate(fragment_config, [make_feed_item("1"), 
+      make_feed_item("2")], 'base_feed').count("Event") == \
+      uncached.count("Event")
+
+
+
+def test_publish_feed(tmp_path):
+    dest = tmp_path / "b.ics"
+    h.publish_feed(h.generate_feed_chunks(FEED_CONFIG, 'ical', 
+      [make_feed_item("1")], 'base_feed'), str(dest))
+
+    with open(dest, "rb") as infile:
+        published = infile.read()
+    assert published.startswith(b"BEGIN:VCALENDAR\r\n")
+    assert b"\n" not in published.replace(b"\r\n", b"")
+
+    # A feed that fails halfway leaves the old one alone
+    def broken_chunks():
+        yield "BEGIN:VCALENDAR\n"
+        raise ValueError("oops")
+    with pytest.raises(ValueError):
+        h.publish_feed(broken_chunks(), str(dest))
+    with open(dest, "rb") as infile:
+        assert infile.read() == published
+    assert os.listdir(tmp_path) == ["b.ics"]
+
+
+
+@pytest.mark.parametrize("workers", [1, 3])
+def test_render_feeds(workers, tmp_path, monkeypatch):
+    monkeypatch.setattr(h, '_fragment_cache', None)
+    render_config = dict(FEED_CONFIG, 
+      feeds=dict(FEED_CONFIG['feeds'], render_workers=workers, 
+        render_parallel_min_items=0),
+      paths={'cache_path': str(tmp_path), 
+        'fragment_cache': {'name': "fragments.json", 
+          'relative_to_cache_path': True}})
+    cache = h.open_fragment_cache(render_config)
+
+    jobs = [{'kind': kind, 'events': [make_feed_item(id)], 
+      'feed_key': 'base_feed', 'dest': str(tmp_path / "{}.{}".format(id, kind))}
+      for kind in ['rss', 'ical'] for id in ["1", "2", "3"]]
+    h.render_feeds(render_config, jobs)
+
+    for job in jobs:
+        with open(job['dest'], encoding='utf8') as infile:
+            assert "Event {}".format(job['events'][0]['id']) in infile.read()
+
+    # Fragments rendered by the workers come back to be saved
+    assert len(cache.used) == 6
+
+
+def test_render_feeds_does_not_fork_with_threads(tmp_path, monkeypatch):
+    import threading
+
+    def no_pool(*args, **kwargs):
+        raise AssertionError("Forked with another thread running")
+    monkeypatch.setattr(h.concurrent.futures, 'ProcessPoolExecutor', no_pool)
+    monkeypatch.setattr(h, '_fragment_cache', None)
+
+    render_config = dict(FEED_CONFIG, 
+      feeds=dict(FEED_CONFIG['feeds'], render_workers=3, 
+        render_parallel_min_items=0))
+    jobs = [{'kind': kind, 'events': [make_feed_item("1")], 
+      'feed_key': 'base_feed', 'dest': str(tmp_path / "1.{}".format(kind))}
+      for kind in ['rss', 'ical']]
+
+    # Like a journal compactor that is still busy
+    done = threading.Event()
+    compactor = threading.Thread(target=done.wait)
+    compactor.start()
+    try:
+        h.render_feeds(render_config, jobs)
+    finally:
+        done.set()
+        compactor.join()
+
+    assert sorted(os.listdir(tmp_path)) == ["1.ical", "1.rss"]
+
+
 """
 # ==== TEST MARKDOWN 
 